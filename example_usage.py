@@ -4,8 +4,11 @@ Example: Using diagnostics in your application
 This shows how to integrate the diagnostic system into your own code
 """
 
+import os
 import sys
-sys.path.append('/home/acp/work')
+
+# Make the diagnostic modules next to this file importable from anywhere
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
 # Example 1: Run full diagnostics programmatically
 def example_full_diagnostics():
@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+"""
+Shared I2C Helpers
+Process-wide SMBus handle and PCA9548A multiplexer channel selection
+shared by the test modules
+"""
+
+import atexit
+import os
+import time
+from fcntl import ioctl
+
+try:
+    import smbus2 as smbus
+    from smbus2 import i2c_msg
+except ImportError:
+    import smbus
+    i2c_msg = None
+
+I2C_BUS = 1
+MUX_ADDR = 0x70
+
+# Control byte for each multiplexer channel
+_CHANNEL_MASKS = {channel: 1 << channel for channel in range(8)}
+
+# Addresses probed on each channel (valid 7-bit range minus the mux itself)
+SCAN_ADDRS = tuple(a for a in range(0x03, 0x78) if a != MUX_ADDR)
+
+# Like i2cdetect, probe EEPROM-style ranges with a read instead of a quick
+# write - a quick write can corrupt write-protect state on some EEPROMs
+READ_PROBE_ADDRS = frozenset(list(range(0x30, 0x38)) + list(range(0x50, 0x60)))
+
+# i2c-dev ioctl selecting the target address of plain read()/write() calls
+I2C_SLAVE = 0x0703
+
+# Open SMBus handles by bus number
+_buses = {}
+
+# Open FastI2C handles by bus number
+_fast_buses = {}
+
+# Last mask written to the multiplexer on each bus, by bus number
+# (missing = unknown)
+_last_mask = {}
+
+def get_bus(bus_num=I2C_BUS):
+    """
+    Return the shared SMBus handle for bus_num, opening it on first use
+
+    The handle is closed automatically at exit - callers must not close it.
+    """
+    bus = _buses.get(bus_num)
+    if bus is None:
+        bus = smbus.SMBus(bus_num)
+        _buses[bus_num] = bus
+        atexit.register(bus.close)
+    return bus
+
+class FastI2C:
+    """
+    Raw i2c-dev access for the hot paths: mux selects and presence probes
+
+    Plain write()/read() on the device file, with the target address set
+    by ioctl only when it changes - no SMBus ioctl structures built per
+    call. Provides the write_byte/read_byte subset used by the helpers
+    here, so it can stand in for an SMBus handle.
+    """
+
+    def __init__(self, bus_num=I2C_BUS):
+        self.fd = os.open(f"/dev/i2c-{bus_num}", os.O_RDWR)
+        self.bus_num = bus_num
+        self._addr = None
+
+    def _target(self, addr):
+        if addr != self._addr:
+            self._addr = None  # Unknown until the ioctl succeeds
+            ioctl(self.fd, I2C_SLAVE, addr)
+            self._addr = addr
+
+    def write_byte(self, addr, value):
+        self._target(addr)
+        os.write(self.fd, bytes((value,)))
+
+    def read_byte(self, addr):
+        self._target(addr)
+        return os.read(self.fd, 1)[0]
+
+    def probe(self, addr):
+        """Presence probe; raises OSError if addr NACKs"""
+        self._target(addr)
+        if addr in READ_PROBE_ADDRS:
+            os.read(self.fd, 1)
+        else:
+            os.write(self.fd, b'')
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+def get_fast_bus(bus_num=I2C_BUS):
+    """
+    Return the shared FastI2C handle for bus_num
+
+    Falls back to the shared SMBus handle if the i2c-dev device can't be
+    opened directly. Closed automatically at exit.
+    """
+    bus = _fast_buses.get(bus_num)
+    if bus is None:
+        try:
+            bus = FastI2C(bus_num)
+        except OSError:
+            return get_bus(bus_num)
+        _fast_buses[bus_num] = bus
+        atexit.register(bus.close)
+    return bus
+
+def _bus_number(bus):
+    """Bus number of a handle (I2C_BUS for handles not opened here)"""
+    bus_num = getattr(bus, 'bus_num', None)
+    if bus_num is not None:
+        return bus_num
+    for bus_num, shared in _buses.items():
+        if shared is bus:
+            return bus_num
+    return I2C_BUS
+
+def select_channel(bus, channel, settle=0.0, verify=False):
+    """
+    Select channel on PCA9548A multiplexer
+
+    The write (and the settle delay) is skipped when the channel is
+    already selected. The selection is cached per bus number, so handles
+    on different buses can be used from different threads.
+
+    Args:
+        bus: Open SMBus handle
+        channel: Channel number (0-7)
+        settle: Seconds to wait after switching channels
+        verify: Read the control register back after switching
+
+    Raises:
+        ValueError: If channel isn't 0-7
+        OSError: If verify is set and the multiplexer didn't switch
+    """
+    try:
+        mask = _CHANNEL_MASKS[channel]
+    except KeyError:
+        raise ValueError("Channel must be between 0 and 7") from None
+    bus_num = _bus_number(bus)
+    if mask == _last_mask.get(bus_num):
+        return
+
+    _last_mask.pop(bus_num, None)  # Unknown until the write succeeds
+    bus.write_byte(MUX_ADDR, mask)
+
+    # The PCA9548A switches within the write - one read-back (a few
+    # hundred microseconds) confirms it without a fixed sleep
+    if verify and bus.read_byte(MUX_ADDR) != mask:
+        raise OSError(f"Multiplexer did not switch to channel {channel}")
+    _last_mask[bus_num] = mask
+
+    if settle:
+        time.sleep(settle)
+
+def disable_channels(bus, settle=0.0):
+    """Disable all multiplexer channels (always written)"""
+    bus_num = _bus_number(bus)
+    _last_mask.pop(bus_num, None)
+    bus.write_byte(MUX_ADDR, 0x00)
+    _last_mask[bus_num] = 0x00
+
+    if settle:
+        time.sleep(settle)
+
+def invalidate_channel(bus_num=None):
+    """
+    Forget the cached channel (e.g. after something else drove the mux)
+
+    Args:
+        bus_num: Bus to forget, or None for every bus
+    """
+    if bus_num is None:
+        _last_mask.clear()
+    else:
+        _last_mask.pop(bus_num, None)
+
+def make_probes(bus, addrs=SCAN_ADDRS):
+    """
+    Build a presence probe for every address in addrs
+
+    Returns:
+        list: (addr, probe) pairs; probe() raises OSError if addr NACKs
+    """
+    if isinstance(bus, FastI2C):
+        probe = bus.probe
+        return [(addr, lambda addr=addr: probe(addr)) for addr in addrs]
+
+    if i2c_msg is not None:
+        # smbus2: one I2C_RDWR ioctl per probe. The address travels in the
+        # message, so there's no extra I2C_SLAVE ioctl per address. The
+        # messages are built once and reused on every channel.
+        # (A single I2C_RDWR with all addresses doesn't work - the kernel
+        # aborts the whole transfer at the first NACK.)
+        rdwr = bus.i2c_rdwr
+        probes = []
+        for addr in addrs:
+            if addr in READ_PROBE_ADDRS:
+                msg = i2c_msg.read(addr, 1)
+            else:
+                msg = i2c_msg.write(addr, [])
+            probes.append((addr, lambda msg=msg: rdwr(msg)))
+        return probes
+
+    # Legacy smbus has no i2c_rdwr
+    return [
+        (addr, lambda addr=addr: bus.read_byte(addr) if addr in READ_PROBE_ADDRS
+         else bus.write_quick(addr))
+        for addr in addrs
+    ]
+
+def read_registers(bus, addr, reg, length):
+    """
+    Read length bytes starting at register reg
+
+    With smbus2 this is a register write and a read in one combined
+    (repeated-start) I2C_RDWR transaction, without the SMBus 32-byte
+    block limit.
+    """
+    if i2c_msg is None:
+        return bus.read_i2c_block_data(addr, reg, length)
+
+    read = i2c_msg.read(addr, length)
+    bus.i2c_rdwr(i2c_msg.write(addr, [reg]), read)
+    return list(read)
+
+def _crc8_byte(value):
+    """CRC-8 (polynomial 0x31) of a single byte, without the initial value"""
+    for _ in range(8):
+        value = ((value << 1) ^ 0x31) & 0xFF if value & 0x80 else (value << 1) & 0xFF
+    return value
+
+# CRC-8/0x31 of every byte value, so a check is one lookup per byte
+_CRC8_TABLE = bytes(_crc8_byte(i) for i in range(256))
+
+def crc8(b0, b1):
+    """CRC-8 of a 2-byte word as sent by Sensirion sensors (SHT3x/SHT4x)"""
+    crc = _CRC8_TABLE[0xFF ^ b0]
+    return _CRC8_TABLE[crc ^ b1]
+
+def send_command(bus, addr, command):
+    """Write the command bytes to addr (e.g. to start an SHT3x measurement)"""
+    if i2c_msg is None:
+        bus.write_i2c_block_data(addr, command[0], list(command[1:]))
+    else:
+        bus.i2c_rdwr(i2c_msg.write(addr, command))
+
+def read_bytes(bus, addr, length):
+    """Plain read of length bytes from addr, without a register pointer"""
+    if i2c_msg is None:
+        # Legacy smbus can't do a plain multi-byte read
+        return bus.read_i2c_block_data(addr, 0x00, length)
+
+    read = i2c_msg.read(addr, length)
+    bus.i2c_rdwr(read)
+    return list(read)
+
+def command_read(bus, addr, command, length, delay):
+    """
+    Send a command, wait delay seconds, then read length bytes
+
+    For command-based sensors (e.g. SHT3x) whose results are read without
+    a register pointer.
+    """
+    send_command(bus, addr, command)
+    time.sleep(delay)
+    return read_bytes(bus, addr, length)
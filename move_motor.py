@@ -1,13 +1,75 @@
 #!/usr/bin/env python3
 import requests
+from requests.adapters import HTTPAdapter
 import sys
-import time
 
 MOONRAKER_URL = "http://localhost:7125"
 
-def move_manual_stepper(stepper_name, distance, speed):
+# Keep-alive session so repeated commands reuse one connection to Moonraker
+_SESSION = requests.Session()
+_SESSION.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=4))
+
+def send_gcode(*commands, timeout=None):
+    """Send one or more G-Code commands to Moonraker as a single script"""
+    script = "\n".join(commands)
+    return _SESSION.post(f"{MOONRAKER_URL}/printer/gcode/script", params={"script": script}, timeout=timeout)
+
+def finish_moves(stepper_names, timeout=60.0):
+    """
+    Wait for queued SYNC=0 moves to finish, then power the steppers down.
+    ENABLE=0 first syncs each stepper's queued moves into the toolhead
+    timeline, and M400 holds the request until that timeline has run out,
+    so the response arrives once every move is done.
+    Returns True once finished, False on timeout or error.
+    """
+    commands = [f"MANUAL_STEPPER STEPPER={name} ENABLE=0" for name in stepper_names]
+    try:
+        response = send_gcode(*commands, "M400", timeout=timeout)
+    except requests.Timeout:
+        return False
+    return response.status_code == 200
+
+def start_move(stepper_name, distance, speed):
+    """
+    Queue a relative move on a manual stepper without waiting for it.
+    SYNC=0 lets moves on other steppers run in parallel with this one.
+    """
+    # Reset position to 0 so our move is relative
+    cmd_reset = f"MANUAL_STEPPER STEPPER={stepper_name} SET_POSITION=0"
+    cmd_move = f"MANUAL_STEPPER STEPPER={stepper_name} ENABLE=1 MOVE={distance} SPEED={speed} SYNC=0"
+    return send_gcode(cmd_reset, cmd_move)
+
+def move_steppers(moves, timeout=60.0):
+    """
+    Move several manual steppers at once.
+    moves: list of (stepper_name, distance, speed)
+    """
+    started = []
+    for stepper_name, distance, speed in moves:
+        print(f"Starting {stepper_name}: {distance}mm at {speed}mm/s...")
+        response = start_move(stepper_name, distance, speed)
+        if response.status_code == 200:
+            started.append(stepper_name)
+        else:
+            print(f"✗ Failed: {response.text}")
+    
+    if not started:
+        return False
+    
+    if not finish_moves(started, timeout):
+        print("✗ Moves did not finish (timeout or Klipper error)")
+        return False
+    
+    print(f"✓ Moves complete: {', '.join(started)}")
+    print("✓ Motors released")
+    return len(started) == len(moves)
+
+def move_manual_stepper(stepper_name, distance, speed, sync=False):
     """
     Moves a manual stepper using Klipper's MANUAL_STEPPER command.
+    
+    By default the move is queued (SYNC=0) and finish_moves() waits for
+    it; sync=True blocks the request for the whole move instead.
     """
     # Construct G-Code command
     # ENABLE=1 ensures the stepper is powered
@@ -17,34 +79,43 @@ def move_manual_stepper(stepper_name, distance, speed):
     # No, "The MOVE parameter specifies the target position." (Absolute)
     # To do a relative move, we can use SET_POSITION=0 first.
     
+    if not sync:
+        return move_steppers([(stepper_name, distance, speed)])
+    
     print(f"Attempting to move {stepper_name} by {distance}mm at {speed}mm/s...")
 
     # 1. Reset position to 0 so our move is relative
     cmd_reset = f"MANUAL_STEPPER STEPPER={stepper_name} SET_POSITION=0"
-    requests.post(f"{MOONRAKER_URL}/printer/gcode/script", params={"script": cmd_reset})
     
     # 2. Execute Move (Blocking with SYNC=1)
     cmd_move = f"MANUAL_STEPPER STEPPER={stepper_name} ENABLE=1 MOVE={distance} SPEED={speed} SYNC=1"
-    response = requests.post(f"{MOONRAKER_URL}/printer/gcode/script", params={"script": cmd_move})
+    
+    # 3. Release Motor
+    cmd_release = f"MANUAL_STEPPER STEPPER={stepper_name} ENABLE=0"
+    
+    # All three go out in one request; Klipper aborts the rest of a
+    # script on the first error, so the release only runs after a good move
+    response = send_gcode(cmd_reset, cmd_move, cmd_release)
     
     if response.status_code == 200:
         print(f"✓ Move complete: {cmd_move}")
-        
-        # 3. Release Motor
-        cmd_release = f"MANUAL_STEPPER STEPPER={stepper_name} ENABLE=0"
-        requests.post(f"{MOONRAKER_URL}/printer/gcode/script", params={"script": cmd_release})
-        print(f"✓ Motor released")
+        print("✓ Motor released")
+        return True
     else:
         print(f"✗ Failed: {response.text}")
+        return False
 
 if __name__ == "__main__":
-    if len(sys.argv) < 2:
-        print("Usage: python3 move_motor.py <stepper_name> [distance] [speed]")
+    sync = "--sync" in sys.argv
+    args = [a for a in sys.argv[1:] if a != "--sync"]
+    
+    if len(args) < 1:
+        print("Usage: python3 move_motor.py <stepper_name> [distance] [speed] [--sync]")
         print("Example: python3 move_motor.py stepper_0 10 10")
         sys.exit(1)
         
-    stepper = sys.argv[1]
-    dist = sys.argv[2] if len(sys.argv) > 2 else "10"
-    speed = sys.argv[3] if len(sys.argv) > 3 else "10"
+    stepper = args[0]
+    dist = args[1] if len(args) > 1 else "10"
+    speed = args[2] if len(args) > 2 else "10"
     
-    move_manual_stepper(stepper, dist, speed)
+    move_manual_stepper(stepper, dist, speed, sync=sync)
@@ -4,19 +4,19 @@ Quick I2C test - Simple version
 Tests PCA9548A multiplexer and scans all channels
 """
 
-try:
-    import smbus2 as smbus
-except ImportError:
-    import smbus
+from i2c_shared import get_bus, select_channel, disable_channels, make_probes
 
 I2C_BUS = 1
 MUX_ADDR = 0x70
 
+# Display strings for every 7-bit address, indexed by address
+ADDR_STRS = tuple(f"0x{a:02X}" for a in range(0x80))
+
 def run_test():
     print("Quick I2C Test\n" + "="*40)
     
     try:
-        bus = smbus.SMBus(I2C_BUS)
+        bus = get_bus(I2C_BUS)
         
         # Test multiplexer
         print(f"Testing multiplexer at 0x{MUX_ADDR:02X}...")
@@ -24,29 +24,25 @@ def run_test():
         print(f"✓ Multiplexer OK (state: 0b{current:08b})\n")
         
         # Scan each channel
+        # A quick write (address + W, no data) is ACKed by every device,
+        # including ones like the SHT31 that won't ACK a bare read, so one
+        # probe per address is enough.
+        probes = make_probes(bus)
+        total_devices = 0
         for ch in range(8):
-            bus.write_byte(MUX_ADDR, 1 << ch)
+            select_channel(bus, ch)
             print(f"Channel {ch}:", end=" ")
             
             devices = []
-            for addr in range(0x03, 0x78):
-                if addr == MUX_ADDR:
-                    continue
-                found = False
+            append = devices.append
+            for addr, probe in probes:
                 try:
-                    bus.read_byte(addr)
-                    found = True
-                except:
-                    # Some devices (like SHT31) might not ACK a read without a command
-                    # Try writing a dummy byte (0x00) to see if it ACKs
-                    try:
-                        bus.write_byte(addr, 0x00)
-                        found = True
-                    except:
-                        pass
-                
-                if found:
-                    devices.append(f"0x{addr:02X}")
+                    probe()
+                except OSError:
+                    continue
+                append(ADDR_STRS[addr])
+            
+            total_devices += len(devices)
             
             if devices:
                 print(", ".join(devices))
@@ -54,11 +50,10 @@ def run_test():
                 print("(empty)")
         
         # Disable all channels
-        bus.write_byte(MUX_ADDR, 0x00)
-        bus.close()
+        disable_channels(bus)
         
         print("\n✓ Test complete!")
-        return {'status': 'pass', 'devices_found': sum(len(devices) for devices in [devices])}
+        return {'status': 'pass', 'devices_found': total_devices}
         
     except Exception as e:
         print(f"✗ Error: {e}")
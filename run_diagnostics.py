@@ -7,32 +7,59 @@ This is the main entry point for running system diagnostics.
 Add new test modules to the TESTS list to extend functionality.
 """
 
+import io
+import os
 import sys
 import time
-import importlib.util
-import inspect
-from pathlib import Path
-from datetime import datetime
+import threading
+from collections import Counter
+from contextlib import nullcontext
+from types import MappingProxyType, SimpleNamespace
+
+# Test modules live next to this file; make them importable by name
+_SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+if _SCRIPT_DIR not in sys.path:
+    sys.path.insert(0, _SCRIPT_DIR)
+
+# Shared I2C bus 1 - tests holding this lock never overlap on the bus
+I2C_BUS_LOCK = threading.Lock()
+
+# Serializes console output from concurrently running tests
+OUTPUT_LOCK = threading.Lock()
+
+# Seconds a test may run before it is reported as hung (per-test 'timeout')
+DEFAULT_TEST_TIMEOUT = 5.0
+
+# Bus locks still held by a timed-out test - later users fail immediately
+# instead of waiting for a test that may never return
+_HUNG_LOCKS = set()
+_HUNG_GUARD = threading.Lock()  # Orders a late return against its timeout
 
 # Test configuration
+# Critical tests run first, one at a time. The remaining tests run in
+# parallel; tests sharing a 'bus_lock' are serialized against each other.
 TESTS = [
     {
         'name': 'I2C Multiplexer',
         'module': 'test_multiplexer',
         'critical': True,  # If True, failure stops further tests
-        'enabled': True
+        'enabled': True,
+        'bus_lock': I2C_BUS_LOCK,
+        'timeout': 2.0  # Fail fast so a hung bus doesn't stall boot
     },
     {
         'name': 'Temperature Sensors',
         'module': 'test_temperature',
         'critical': False,
-        'enabled': True
+        'enabled': True,
+        'bus_lock': I2C_BUS_LOCK
     },
     {
         'name': 'OLED Displays',
         'module': 'test_oled',
         'critical': False,
         'enabled': True,
+        'bus_lock': I2C_BUS_LOCK,
         'args': {'visual': False}  # Set to True for visual tests
     },
     {
@@ -46,32 +73,102 @@ TESTS = [
         'name': 'Motor Controller (Klipper)',
         'module': 'test_klipper',
         'critical': False,
-        'enabled': True
+        'enabled': True,
+        'timeout': 12.0  # Preflight + parallel queries + M115, all at HTTP_TIMEOUT
     }
 ]
 
-# Color codes for terminal output
-class Colors:
-    HEADER = '\033[95m'
-    OKBLUE = '\033[94m'
-    OKCYAN = '\033[96m'
-    OKGREEN = '\033[92m'
-    WARNING = '\033[93m'
-    FAIL = '\033[91m'
-    ENDC = '\033[0m'
-    BOLD = '\033[1m'
-    UNDERLINE = '\033[4m'
+# Installed packages can register extra tests under this entry point group,
+# e.g. in their pyproject.toml:
+#   [project.entry-points."diagnostics.tests"]
+#   "My Device" = "test_mydevice:run_test"
+ENTRY_POINT_GROUP = 'diagnostics.tests'
+
+# Tests found via entry points (None until first lookup)
+_PLUGIN_TESTS = None
+
+def discover_plugin_tests():
+    """Find tests registered by installed packages (looked up once)"""
+    global _PLUGIN_TESTS
+    if _PLUGIN_TESTS is None:
+        from importlib.metadata import entry_points
+        try:
+            eps = entry_points(group=ENTRY_POINT_GROUP)
+        except TypeError:
+            # Python < 3.10
+            eps = entry_points().get(ENTRY_POINT_GROUP, [])
+        
+        _PLUGIN_TESTS = [
+            {
+                'name': ep.name,
+                'module': ep.value.partition(':')[0],
+                'entry_point': ep,
+                'critical': False,
+                'enabled': True
+            }
+            for ep in eps
+        ]
+    return _PLUGIN_TESTS
+
+def get_tests():
+    """All configured tests: the TESTS list followed by plugin tests"""
+    return TESTS + discover_plugin_tests()
+
+# Enabled tests as read-only views (None until first use)
+_ENABLED_TESTS = None
 
-def load_test_module(module_name):
-    """Dynamically load a test module"""
+def get_enabled_tests():
+    """Enabled tests, filtered once - TESTS is static configuration"""
+    global _ENABLED_TESTS
+    if _ENABLED_TESTS is None:
+        _ENABLED_TESTS = tuple(
+            MappingProxyType(t) for t in get_tests() if t['enabled']
+        )
+    return _ENABLED_TESTS
+
+# Only emit color codes to a terminal (and honor https://no-color.org)
+COLOR_ENABLED = sys.stdout.isatty() and os.environ.get('NO_COLOR') is None
+
+# Color codes for terminal output (all empty when color is disabled)
+_COLOR_CODES = {
+    'HEADER': '\033[95m',
+    'OKBLUE': '\033[94m',
+    'OKCYAN': '\033[96m',
+    'OKGREEN': '\033[92m',
+    'WARNING': '\033[93m',
+    'FAIL': '\033[91m',
+    'ENDC': '\033[0m',
+    'BOLD': '\033[1m',
+    'UNDERLINE': '\033[4m'
+}
+Colors = SimpleNamespace(**{
+    name: (code if COLOR_ENABLED else '') for name, code in _COLOR_CODES.items()
+})
+
+# Precomputed result prefixes
+_PASS_PREFIX = f"{Colors.OKGREEN}✓ PASS{Colors.ENDC}: "
+_FAIL_PREFIX = f"{Colors.FAIL}✗ FAIL{Colors.ENDC}: "
+
+# Source mtime of each test module when it was last (re)loaded
+_MODULE_MTIMES = {}
+
+def load_test_module(module_name, verbose=True):
+    """Dynamically load a test module (reloaded if its source changes)"""
+    import importlib
+    
     try:
-        module_path = Path(__file__).parent / f"{module_name}.py"
-        spec = importlib.util.spec_from_file_location(module_name, module_path)
-        module = importlib.util.module_from_spec(spec)
-        spec.loader.exec_module(module)
+        module = importlib.import_module(module_name)
+        
+        mtime = os.stat(module.__file__).st_mtime
+        if _MODULE_MTIMES.setdefault(module_name, mtime) != mtime:
+            module = importlib.reload(module)
+            _MODULE_MTIMES[module_name] = mtime
+        
         return module
     except Exception as e:
-        print(f"{Colors.FAIL}Error loading module {module_name}: {e}{Colors.ENDC}")
+        if verbose:
+            with OUTPUT_LOCK:
+                print(f"{Colors.FAIL}Error loading module {module_name}: {e}{Colors.ENDC}")
         return None
 
 def print_header():
@@ -79,7 +176,7 @@ def print_header():
     print(f"\n{Colors.BOLD}{'='*70}{Colors.ENDC}")
     print(f"{Colors.BOLD}{Colors.OKCYAN}           SYSTEM DIAGNOSTICS - HARDWARE TEST SUITE{Colors.ENDC}")
     print(f"{Colors.BOLD}{'='*70}{Colors.ENDC}")
-    print(f"Started: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+    print(f"Started: {time.strftime('%Y-%m-%d %H:%M:%S')}")
     print(f"{'='*70}\n")
 
 def print_test_header(test_name, test_num, total_tests):
@@ -89,147 +186,282 @@ def print_test_header(test_name, test_num, total_tests):
 
 def print_result(status, message):
     """Print test result with color"""
-    if status == 'pass':
-        print(f"{Colors.OKGREEN}✓ PASS{Colors.ENDC}: {message}")
-    else:
-        print(f"{Colors.FAIL}✗ FAIL{Colors.ENDC}: {message}")
+    prefix = _PASS_PREFIX if status == 'pass' else _FAIL_PREFIX
+    sys.stdout.write(prefix + message + '\n')
 
 def print_summary(results, start_time):
-    """Print diagnostic summary"""
+    """Print diagnostic summary (built up and written in one go)"""
     elapsed = time.time() - start_time
     
-    print(f"\n{Colors.BOLD}{'='*70}{Colors.ENDC}")
-    print(f"{Colors.BOLD}DIAGNOSTIC SUMMARY{Colors.ENDC}")
-    print(f"{Colors.BOLD}{'='*70}{Colors.ENDC}\n")
+    buf = io.StringIO()
+    w = buf.write
     
-    passed = sum(1 for r in results if r['status'] == 'pass')
-    failed = sum(1 for r in results if r['status'] == 'fail')
-    skipped = sum(1 for r in results if r['status'] == 'skipped')
+    w(f"\n{Colors.BOLD}{'='*70}{Colors.ENDC}\n")
+    w(f"{Colors.BOLD}DIAGNOSTIC SUMMARY{Colors.ENDC}\n")
+    w(f"{Colors.BOLD}{'='*70}{Colors.ENDC}\n\n")
     
-    print(f"Tests Run:    {len(results)}")
-    print(f"{Colors.OKGREEN}Passed:       {passed}{Colors.ENDC}")
+    counts = Counter(r['status'] for r in results)
+    passed = counts['pass']
+    failed = counts['fail']
+    skipped = counts['skipped']
+    
+    w(f"Tests Run:    {len(results)}\n")
+    w(f"{Colors.OKGREEN}Passed:       {passed}{Colors.ENDC}\n")
     if failed > 0:
-        print(f"{Colors.FAIL}Failed:       {failed}{Colors.ENDC}")
+        w(f"{Colors.FAIL}Failed:       {failed}{Colors.ENDC}\n")
     else:
-        print(f"Failed:       {failed}")
+        w(f"Failed:       {failed}\n")
     if skipped > 0:
-        print(f"{Colors.WARNING}Skipped:      {skipped}{Colors.ENDC}")
-    print(f"Duration:     {elapsed:.2f}s")
+        w(f"{Colors.WARNING}Skipped:      {skipped}{Colors.ENDC}\n")
+    w(f"Duration:     {elapsed:.2f}s\n")
     
-    print(f"\n{Colors.BOLD}Test Details:{Colors.ENDC}\n")
+    w(f"\n{Colors.BOLD}Test Details:{Colors.ENDC}\n\n")
     
-    for i, result in enumerate(results, 1):
-        status_symbol = {
-            'pass': f"{Colors.OKGREEN}✓{Colors.ENDC}",
-            'fail': f"{Colors.FAIL}✗{Colors.ENDC}",
-            'skipped': f"{Colors.WARNING}⊝{Colors.ENDC}"
-        }
-        
+    status_symbol = {
+        'pass': f"{Colors.OKGREEN}✓{Colors.ENDC}",
+        'fail': f"{Colors.FAIL}✗{Colors.ENDC}",
+        'skipped': f"{Colors.WARNING}⊝{Colors.ENDC}"
+    }
+    
+    for result in results:
         symbol = status_symbol.get(result['status'], '?')
-        print(f"  {symbol} {result['name']}: {result['message']}")
+        w(f"  {symbol} {result['name']}: {result['message']}\n")
     
-    print(f"\n{'='*70}\n")
+    w(f"\n{'='*70}\n\n")
     
     if failed == 0:
-        print(f"{Colors.OKGREEN}{Colors.BOLD}✓ All critical systems operational{Colors.ENDC}")
-        return 0
+        w(f"{Colors.OKGREEN}{Colors.BOLD}✓ All critical systems operational{Colors.ENDC}\n")
+        exit_code = 0
     else:
-        print(f"{Colors.FAIL}{Colors.BOLD}✗ System has failures - check details above{Colors.ENDC}")
-        return 1
+        w(f"{Colors.FAIL}{Colors.BOLD}✗ System has failures - check details above{Colors.ENDC}\n")
+        exit_code = 1
+    
+    sys.stdout.write(buf.getvalue())
+    sys.stdout.flush()
+    return exit_code
 
-def run_diagnostics(verbose=True, quick=False):
+def invalidate_mux_cache():
+    """Forget the cached mux channel - a hung test may have left it anywhere"""
+    try:
+        import i2c_shared
+    except ImportError:
+        return
+    i2c_shared.invalidate_channel()
+
+def call_with_timeout(func, kwargs, timeout, lock=None):
     """
-    Run all diagnostic tests
+    Call func(**kwargs), giving up after timeout seconds
+    
+    A test stuck in a blocking I2C/USB call can't be interrupted, so it runs
+    in a daemon thread that is simply abandoned on timeout - it never stops
+    diagnostics (or the process) from finishing. While an abandoned test
+    still holds the lock, other calls needing it fail straight away.
     
     Args:
-        verbose: Print detailed output
-        quick: Skip slower tests (visual displays, etc.)
+        func: Function to call
+        kwargs: Keyword arguments for func
+        timeout: Seconds to wait once the lock (if any) is held
+        lock: Bus lock taken inside the worker thread, so an abandoned
+              test keeps the bus until it really returns
     
-    Returns:
-        int: Exit code (0 = all pass, 1 = some failures)
+    Raises:
+        TimeoutError: func did not return in time, or the lock is held by
+                      a test that timed out
     """
-    start_time = time.time()
-    results = []
+    outcome = {}
+    started = threading.Event()
+    done = threading.Event()
+    abandoned = threading.Event()
     
-    if verbose:
-        print_header()
+    def target():
+        with lock if lock is not None else nullcontext():
+            if abandoned.is_set():
+                return  # Caller gave up waiting for the lock
+            started.set()
+            try:
+                outcome['result'] = func(**kwargs)
+            except BaseException as e:
+                outcome['error'] = e
+            with _HUNG_GUARD:
+                done.set()
+                if abandoned.is_set() and lock is not None:
+                    # Late return - reset the mux cache before the next bus user
+                    invalidate_mux_cache()
+                    _HUNG_LOCKS.discard(lock)
     
-    enabled_tests = [t for t in TESTS if t['enabled']]
+    thread = threading.Thread(target=target, daemon=True)
+    thread.start()
     
-    for i, test_config in enumerate(enabled_tests, 1):
-        if verbose:
-            print_test_header(test_config['name'], i, len(enabled_tests))
-        
+    # The timeout starts once the lock is held. Waiting is unbounded while
+    # the holder is a live test (it has its own timeout), but not behind
+    # one that already timed out.
+    while not started.wait(0.05):
+        if lock in _HUNG_LOCKS:
+            abandoned.set()
+            raise TimeoutError("Bus held by a hung test")
+    
+    if not done.wait(timeout):
+        with _HUNG_GUARD:
+            if not done.is_set():
+                abandoned.set()
+                if lock is not None:
+                    _HUNG_LOCKS.add(lock)
+                    invalidate_mux_cache()
+                raise TimeoutError(f"Timed out after {timeout}s")
+    
+    if 'error' in outcome:
+        raise outcome['error']
+    return outcome['result']
+
+def run_single_test(test_config, quick=False, verbose=True):
+    """
+    Load and run a single test module
+    
+    Args:
+        test_config: Entry from the TESTS list
+        quick: Skip slower tests (visual displays, etc.)
+        verbose: Print load errors
+    
+    Returns:
+        dict: Result entry for the summary
+    """
+    entry_point = test_config.get('entry_point')
+    
+    if entry_point is not None:
+        # Plugin test - the entry point resolves straight to run_test()
+        try:
+            run_test = entry_point.load()
+        except Exception as e:
+            return {
+                'name': test_config['name'],
+                'status': 'fail',
+                'message': f'Failed to load entry point: {e}'
+            }
+    else:
         # Load test module
-        module = load_test_module(test_config['module'])
+        module = load_test_module(test_config['module'], verbose)
         
         if module is None:
-            results.append({
+            return {
                 'name': test_config['name'],
                 'status': 'fail',
                 'message': 'Failed to load test module'
-            })
-            continue
+            }
         
         # Check if module has run_test function
         if not hasattr(module, 'run_test'):
-            results.append({
+            return {
                 'name': test_config['name'],
                 'status': 'fail',
                 'message': 'Module missing run_test() function'
-            })
-            continue
+            }
         
-        # Run test
-        try:
-            # Get test arguments if specified
-            test_args = test_config.get('args', {})
-            
-            # Modify args based on quick mode
-            if quick and 'visual' in test_args:
-                test_args['visual'] = False
-            
-            # Run test with or without args
-            if test_args:
-                result = module.run_test(**test_args)
-            else:
-                result = module.run_test()
-            
-            # Store result
-            results.append({
-                'name': test_config['name'],
-                'status': result.get('status', 'fail'),
-                'message': result.get('message', 'No message'),
-                'details': result
-            })
-            
+        run_test = module.run_test
+    
+    # Run test
+    try:
+        # Get test arguments if specified (copied so TESTS is never mutated)
+        test_args = dict(test_config.get('args', {}))
+        
+        # Modify args based on quick mode
+        if quick and 'visual' in test_args:
+            test_args['visual'] = False
+        
+        timeout = test_config.get('timeout', DEFAULT_TEST_TIMEOUT)
+        
+        # Hold the bus lock (if any) so tests sharing a bus don't interleave
+        result = call_with_timeout(run_test, test_args, timeout,
+                                   lock=test_config.get('bus_lock'))
+        
+        return {
+            'name': test_config['name'],
+            'status': result.get('status', 'fail'),
+            'message': result.get('message', 'No message'),
+            'details': result
+        }
+        
+    except TimeoutError as e:
+        return {
+            'name': test_config['name'],
+            'status': 'fail',
+            'message': str(e)
+        }
+    except Exception as e:
+        return {
+            'name': test_config['name'],
+            'status': 'fail',
+            'message': f'Exception: {str(e)}'
+        }
+
+def report_test(entry, test_num, total_tests):
+    """Print the header and result of a finished test"""
+    with OUTPUT_LOCK:
+        print_test_header(entry['name'], test_num, total_tests)
+        print_result(entry['status'], entry['message'])
+        
+        # Print additional details if available
+        error = entry.get('details', {}).get('error')
+        if error:
+            print(f"  {Colors.FAIL}Error: {error}{Colors.ENDC}")
+
+def run_diagnostics(verbose=True, quick=False):
+    """
+    Run all diagnostic tests
+    
+    Critical tests run sequentially first; if any fails, diagnostics stop.
+    The remaining tests are independent and run concurrently.
+    
+    Args:
+        verbose: Print detailed output
+        quick: Skip slower tests (visual displays, etc.)
+    
+    Returns:
+        int: Exit code (0 = all pass, 1 = some failures)
+    """
+    start_time = time.time()
+    results = {}
+    
+    if verbose:
+        print_header()
+    
+    enabled_tests = tuple(enumerate(get_enabled_tests(), 1))
+    total_tests = len(enabled_tests)
+    
+    critical_tests = [(i, t) for i, t in enabled_tests if t.get('critical')]
+    other_tests = [(i, t) for i, t in enabled_tests if not t.get('critical')]
+    
+    critical_failed = False
+    for i, test_config in critical_tests:
+        entry = run_single_test(test_config, quick, verbose)
+        results[i] = entry
+        
+        if verbose:
+            report_test(entry, i, total_tests)
+        
+        # Check if critical test failed
+        if entry['status'] == 'fail':
             if verbose:
-                print_result(result.get('status', 'fail'), result.get('message', 'No message'))
-                
-                # Print additional details if available
-                if result.get('error'):
-                    print(f"  {Colors.FAIL}Error: {result['error']}{Colors.ENDC}")
-            
-            # Check if critical test failed
-            if test_config.get('critical') and result.get('status') == 'fail':
-                if verbose:
-                    print(f"\n{Colors.FAIL}{Colors.BOLD}Critical test failed! Stopping diagnostics.{Colors.ENDC}")
-                break
+                print(f"\n{Colors.FAIL}{Colors.BOLD}Critical test failed! Stopping diagnostics.{Colors.ENDC}")
+            critical_failed = True
+            break
+    
+    if other_tests and not critical_failed:
+        from concurrent.futures import ThreadPoolExecutor, as_completed
+        
+        with ThreadPoolExecutor(max_workers=len(other_tests)) as executor:
+            futures = {
+                executor.submit(run_single_test, test_config, quick, verbose): i
+                for i, test_config in other_tests
+            }
+            for future in as_completed(futures):
+                i = futures[future]
+                results[i] = future.result()
                 
-        except Exception as e:
-            results.append({
-                'name': test_config['name'],
-                'status': 'fail',
-                'message': f'Exception: {str(e)}'
-            })
-            
-            if verbose:
-                print_result('fail', f'Exception: {str(e)}')
-            
-            if test_config.get('critical'):
                 if verbose:
-                    print(f"\n{Colors.FAIL}{Colors.BOLD}Critical test failed! Stopping diagnostics.{Colors.ENDC}")
-                break
+                    report_test(results[i], i, total_tests)
+    
+    # Restore TESTS order for the summary
+    results = [results[i] for i in sorted(results)]
     
     # Print summary
     if verbose:
@@ -271,7 +503,7 @@ Exit codes:
     if args.list:
         print("\nAvailable Tests:")
         print("="*70)
-        for i, test in enumerate(TESTS, 1):
+        for i, test in enumerate(get_tests(), 1):
             status = "ENABLED" if test['enabled'] else "DISABLED"
             critical = " [CRITICAL]" if test.get('critical') else ""
             print(f"{i}. {test['name']}{critical}")
@@ -0,0 +1,463 @@
+#!/usr/bin/env python3
+"""
+Temperature Sensor Core
+Shared SHT3x and BME280/BMP280 drivers for the temperature tests
+(test_temperature.py and test_temp_sensors.py)
+"""
+
+import time
+import struct
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+from i2c_shared import (
+    get_bus, select_channel, disable_channels, read_registers,
+    send_command, read_bytes, crc8
+)
+
+I2C_BUS = 1
+
+# BME280/BMP280 temperature/pressure calibration (0x88-0x9F, little-endian)
+BME280_CAL_TP = struct.Struct('<HhhHhhhhhhhh')
+
+# BME280/BMP280 data burst (0xF7-0xFE, big-endian): pressure and
+# temperature as 16 high bits + 4 bits in the top of the next byte,
+# then 16-bit humidity
+BME280_DATA = struct.Struct('>HBHBH')
+
+# BME280 humidity calibration: dig_H1 (0xA1), then 0xE1-0xE7 with
+# dig_H4/dig_H5 packed as signed 12-bit values across 0xE4-0xE6
+BME280_CAL_H = struct.Struct('<BhBbBbb')
+
+# Status register and its "conversion running" bit
+BME280_STATUS = 0xF3
+BME280_MEASURING = 0x08
+
+# ctrl_meas register: temperature and pressure oversampling x1, plus the
+# mode bits - sleep between samples, forced to take one measurement
+BME280_CTRL_MEAS = 0xF4
+BME280_OSRS_X1 = (0x01 << 5) | (0x01 << 2)
+BME280_FORCED_MODE = 0x01
+
+# Worst-case duration of one conversion at x1 oversampling (9.3ms)
+BME280_MEASURE_TIME = 0.010
+
+# SHT3x single-shot measurement command and its worst-case duration (15.5ms)
+SHT3X_MEASURE = [0x24, 0x00]
+SHT3X_MEASURE_TIME = 0.016
+
+class Reading:
+    """
+    One sensor reading - values the sensor doesn't measure stay None
+    
+    A slotted object rather than a dict: fixed attributes, no per-reading
+    key hashing, and a smaller footprint for long monitoring runs.
+    """
+    
+    __slots__ = ('success', 'temperature', 'humidity', 'pressure', 'chip', 'error')
+    
+    def __init__(self, success=False, temperature=None, humidity=None,
+                 pressure=None, chip=None, error=None):
+        self.success = success
+        self.temperature = temperature
+        self.humidity = humidity
+        self.pressure = pressure
+        self.chip = chip
+        self.error = error
+    
+    def as_dict(self):
+        """Result dict with only the fields that are set (as run_test() reports)"""
+        return {
+            name: getattr(self, name)
+            for name in self.__slots__
+            if getattr(self, name) is not None
+        }
+
+# Timestamped readings kept per sensor by ReadingLog
+LOG_LEN = 4096
+LOG_DTYPE = [('t', 'f8'), ('temperature', 'f4'), ('humidity', 'f4'), ('pressure', 'f4')]
+
+class ReadingLog:
+    """
+    Ring buffer of the last LOG_LEN readings of one sensor (requires numpy)
+    
+    One preallocated record array (fields from LOG_DTYPE) - appending
+    allocates nothing, and each field is a contiguous column ready for
+    numpy statistics. Values the sensor doesn't measure are NaN.
+    """
+    
+    __slots__ = ('data', 'count')
+    
+    def __init__(self, size=LOG_LEN):
+        self.data = np.full(size, np.nan, dtype=LOG_DTYPE)
+        self.count = 0
+    
+    def append(self, t, reading):
+        """Store reading (a successful Reading) taken at time t"""
+        self.data[self.count % len(self.data)] = (
+            t, reading.temperature, reading.humidity, reading.pressure
+        )
+        self.count += 1
+    
+    def last(self, n=None, field=None):
+        """
+        Return the most recent n entries (default: all kept), oldest first
+        
+        Args:
+            n: Number of entries
+            field: Return just this column (e.g. 'temperature')
+        """
+        size = len(self.data)
+        kept = min(self.count, size)
+        n = kept if n is None else min(n, kept)
+        rows = np.arange(self.count - n, self.count) % size
+        data = self.data if field is None else self.data[field]
+        return data[rows]
+
+def select_mux_channel(bus, channel):
+    """
+    Select channel on PCA9548A multiplexer (no-op if already selected,
+    or if channel is None - a sensor not behind the multiplexer)
+    """
+    if channel is not None:
+        select_channel(bus, channel)
+
+def sensor_bus(bus, sensor):
+    """Return the bus handle for sensor: bus, or its own bus if it has one"""
+    bus_num = sensor.get('i2c_bus', I2C_BUS)
+    return bus if bus_num == I2C_BUS else get_bus(bus_num)
+
+def disable_mux_channels(bus):
+    """Disable all multiplexer channels"""
+    disable_channels(bus)
+
+def sht3x_trigger(bus, addr):
+    """
+    Start an SHT3x measurement (high repeatability, clock stretching
+    disabled) - the result is ready SHT3X_MEASURE_TIME later
+    """
+    send_command(bus, addr, SHT3X_MEASURE)
+
+def sht3x_fetch(bus, addr):
+    """Read and convert a finished SHT3x measurement"""
+    try:
+        data = read_bytes(bus, addr, 6)
+        if crc8(data[0], data[1]) != data[2] or crc8(data[3], data[4]) != data[5]:
+            raise ValueError('CRC mismatch')
+        
+        # Convert temperature data
+        temp_raw = (data[0] << 8) | data[1]
+        temp_c = -45 + (175 * temp_raw / 65535.0)
+        
+        # Convert humidity data
+        hum_raw = (data[3] << 8) | data[4]
+        humidity = 100 * hum_raw / 65535.0
+        
+        return Reading(success=True, temperature=temp_c, humidity=humidity)
+    except Exception as e:
+        return Reading(error=str(e))
+
+def read_sht3x(bus, addr):
+    """Read temperature and humidity from SHT3x sensor"""
+    try:
+        sht3x_trigger(bus, addr)
+    except Exception as e:
+        return Reading(error=str(e))
+    
+    time.sleep(SHT3X_MEASURE_TIME)
+    return sht3x_fetch(bus, addr)
+
+# Per-sensor state after the first read, keyed by (bus, channel, address):
+# calibration coefficients and chip type. Once configured, later reads
+# only trigger a forced measurement and fetch the data registers.
+_bme_state = {}
+
+def _bme_wait_ready(bus, addr, timeout=0.02):
+    """
+    Wait while the BME280/BMP280 status register shows a conversion
+    running, polling with exponential backoff (1ms, 2ms, 4ms, ...)
+    """
+    deadline = time.monotonic() + timeout
+    delay = 0.001
+    while bus.read_byte_data(addr, BME280_STATUS) & BME280_MEASURING:
+        if time.monotonic() >= deadline:
+            raise OSError('Measurement did not complete')
+        time.sleep(delay)
+        delay *= 2
+
+def _bme_init(bus, addr):
+    """
+    Reset and configure a BME280/BMP280, returning its calibration state
+    
+    A sensor already holding this configuration (left by an earlier run -
+    it stays powered) is used as is, without the reset and its delay.
+    """
+    # Read chip ID to determine if BME280 or BMP280
+    chip_id = bus.read_byte_data(addr, 0xD0)
+    
+    is_bme280 = (chip_id == 0x60)
+    is_bmp280 = (chip_id == 0x58)
+    
+    if not (is_bme280 or is_bmp280):
+        raise ValueError(f'Unknown chip ID: 0x{chip_id:02X}')
+    
+    # ctrl_hum (0xF2), status, ctrl_meas (sleep mode) and config (0xF5)
+    ctrl_hum, _, ctrl_meas, config = read_registers(bus, addr, 0xF2, 4)
+    configured = (ctrl_meas == BME280_OSRS_X1 and config == 0x00 and
+                  (not is_bme280 or ctrl_hum & 0x07 == 0x01))
+    
+    if not configured:
+        # Reset the device
+        bus.write_byte_data(addr, 0xE0, 0xB6)
+        time.sleep(0.01)
+    
+    # Read calibration data
+    cal = read_registers(bus, addr, 0x88, 24)
+    if is_bme280:
+        cal += read_registers(bus, addr, 0xA1, 1)
+        cal += read_registers(bus, addr, 0xE1, 7)
+    cal = bytes(cal)
+    
+    # Parse calibration coefficients
+    state = {
+        'is_bme280': is_bme280,
+        'tp': BME280_CAL_TP.unpack_from(cal),
+        'h': None
+    }
+    
+    if is_bme280:
+        dig_H1, dig_H2, dig_H3, e4, e5, e6, dig_H6 = BME280_CAL_H.unpack_from(cal, 24)
+        dig_H4 = (e4 << 4) | (e5 & 0x0F)
+        dig_H5 = (e6 << 4) | (e5 >> 4)
+        state['h'] = (dig_H1, dig_H2, dig_H3, dig_H4, dig_H5, dig_H6)
+    
+    # Configure sensor (sleep mode until a sample is requested)
+    if not configured:
+        if is_bme280:
+            bus.write_byte_data(addr, 0xF2, 0x01)  # humidity oversampling x1
+        bus.write_byte_data(addr, BME280_CTRL_MEAS, BME280_OSRS_X1)  # temp and pressure oversampling x1
+        bus.write_byte_data(addr, 0xF5, 0x00)  # config: filter off
+    
+    return state
+
+def _compensate_tp(adc_t, adc_p, tp):
+    """
+    Bosch fixed-point temperature and pressure compensation
+    
+    Returns:
+        tuple: (t_fine, temperature in centi-°C, pressure in Pa as Q24.8)
+    """
+    (dig_T1, dig_T2, dig_T3,
+     dig_P1, dig_P2, dig_P3, dig_P4, dig_P5,
+     dig_P6, dig_P7, dig_P8, dig_P9) = tp
+    
+    # Temperature compensation (centi-degC)
+    var1 = (((adc_t >> 3) - (dig_T1 << 1)) * dig_T2) >> 11
+    var2 = (((((adc_t >> 4) - dig_T1) * ((adc_t >> 4) - dig_T1)) >> 12) * dig_T3) >> 14
+    t_fine = var1 + var2
+    temp = (t_fine * 5 + 128) >> 8
+    
+    # Pressure compensation (Pa in Q24.8)
+    var1 = t_fine - 128000
+    var2 = var1 * var1 * dig_P6
+    var2 = var2 + ((var1 * dig_P5) << 17)
+    var2 = var2 + (dig_P4 << 35)
+    var1 = ((var1 * var1 * dig_P3) >> 8) + ((var1 * dig_P2) << 12)
+    var1 = (((1 << 47) + var1) * dig_P1) >> 33
+    
+    if var1 == 0:
+        return t_fine, temp, 0
+    
+    p = 1048576 - adc_p
+    p = (((p << 31) - var2) * 3125) // var1
+    var1 = (dig_P9 * (p >> 13) * (p >> 13)) >> 25
+    var2 = (dig_P8 * p) >> 19
+    p = ((p + var1 + var2) >> 8) + (dig_P7 << 4)
+    return t_fine, temp, p
+
+def _compensate_h(adc_h, t_fine, cal_h):
+    """Bosch fixed-point humidity compensation - returns %RH as Q22.10"""
+    dig_H1, dig_H2, dig_H3, dig_H4, dig_H5, dig_H6 = cal_h
+    h = t_fine - 76800
+    h = ((((adc_h << 14) - (dig_H4 << 20) - (dig_H5 * h)) + 16384) >> 15) * \
+        (((((((h * dig_H6) >> 10) * (((h * dig_H3) >> 11) + 32768)) >> 10) +
+           2097152) * dig_H2 + 8192) >> 14)
+    h = h - (((((h >> 15) * (h >> 15)) >> 7) * dig_H1) >> 4)
+    return max(0, min(419430400, h))
+
+# Whether the numba builds of the kernels are in use (see enable_jit)
+_jit_enabled = False
+
+def enable_jit():
+    """
+    Switch the compensation kernels to numba builds, if numba is installed
+    
+    Importing numba and compiling cost hundreds of ms, so this is left to
+    long-running callers (continuous monitoring) instead of done at import.
+    
+    Returns:
+        bool: True if the compiled kernels are in use
+    """
+    global _compensate_tp, _compensate_h, _jit_enabled
+    
+    if _jit_enabled:
+        return True
+    try:
+        from numba import njit
+    except ImportError:
+        return False
+    
+    # Native int64 arithmetic, exactly as in the Bosch C reference
+    compensate_tp = njit(cache=True)(_compensate_tp)
+    compensate_h = njit(cache=True)(_compensate_h)
+    # Compile (or load the cached build) now, not on the first sample
+    compensate_h(0, compensate_tp(0, 0, (1,) * 12)[0], (0,) * 6)
+    
+    _compensate_tp, _compensate_h = compensate_tp, compensate_h
+    _jit_enabled = True
+    return True
+
+def compensate_bme280(adc_t, adc_p, adc_h, state):
+    """
+    Convert raw BME280/BMP280 readings with the Bosch fixed-point formulas
+    
+    Args:
+        adc_t, adc_p: Raw temperature and pressure readings
+        adc_h: Raw humidity reading (None on a BMP280)
+        state: Calibration state from _bme_init
+    
+    Returns:
+        tuple: (temperature °C, pressure hPa, humidity % or None)
+    """
+    t_fine, temp, pressure = _compensate_tp(adc_t, adc_p, state['tp'])
+    
+    humidity = None
+    if adc_h is not None:
+        humidity = (_compensate_h(adc_h, t_fine, state['h']) >> 12) / 1024.0
+    
+    return temp / 100.0, pressure / 25600.0, humidity
+
+def _bme_sample(bus, addr, state):
+    """
+    Measure, read and compensate one sample from a configured BME280/BMP280
+    
+    Each sample is a forced-mode conversion, so the data is always fresh
+    and the sensor sleeps between reads.
+    """
+    is_bme280 = state['is_bme280']
+    
+    # Trigger one conversion and wait for it
+    bus.write_byte_data(addr, BME280_CTRL_MEAS, BME280_OSRS_X1 | BME280_FORCED_MODE)
+    time.sleep(BME280_MEASURE_TIME)
+    _bme_wait_ready(bus, addr)
+    
+    # Read raw data
+    p_hi, p_lo, t_hi, t_lo, h = BME280_DATA.unpack(bytes(read_registers(bus, addr, 0xF7, 8)))
+    
+    adc_p = (p_hi << 4) | (p_lo >> 4)
+    adc_t = (t_hi << 4) | (t_lo >> 4)
+    adc_h = h if is_bme280 else None
+    
+    temp_c, pressure_hpa, humidity = compensate_bme280(adc_t, adc_p, adc_h, state)
+    
+    chip_name = "BME280" if is_bme280 else "BMP280"
+    
+    return Reading(success=True, temperature=temp_c, humidity=humidity,
+                   pressure=pressure_hpa, chip=chip_name)
+
+def read_bme280(bus, addr, channel=None):
+    """
+    Read temperature, humidity, and pressure from BME280/BMP280
+    
+    The sensor is reset, calibrated and configured on the first read only
+    (per bus, channel and address); a failed read forces that again next
+    time.
+    """
+    key = (bus, channel, addr)
+    try:
+        state = _bme_state.get(key)
+        if state is None:
+            state = _bme_init(bus, addr)
+            _bme_state[key] = state
+        return _bme_sample(bus, addr, state)
+        
+    except Exception as e:
+        _bme_state.pop(key, None)
+        return Reading(error=str(e))
+
+def _read_bus_sensors(bus, sensors):
+    """
+    Read sensors that all sit on bus
+    
+    SHT3x measurements are started first and fetched last, so their
+    conversion time overlaps the BME280 readouts on the other channels
+    instead of being slept through.
+    """
+    results = {}
+    
+    # Start SHT3x conversions
+    pending = []
+    for sensor in sensors:
+        if sensor['type'] != 'sht3x':
+            continue
+        select_mux_channel(bus, sensor['channel'])
+        try:
+            sht3x_trigger(bus, sensor['address'])
+            pending.append((sensor, time.monotonic() + SHT3X_MEASURE_TIME))
+        except Exception as e:
+            results[sensor['name']] = Reading(error=str(e))
+    
+    # BME280/BMP280 readouts while they convert
+    for sensor in sensors:
+        if sensor['type'] == 'bme280':
+            select_mux_channel(bus, sensor['channel'])
+            results[sensor['name']] = read_bme280(bus, sensor['address'], sensor['channel'])
+    
+    # Collect SHT3x results, waiting out whatever conversion time is left
+    for sensor, ready in pending:
+        remaining = ready - time.monotonic()
+        if remaining > 0:
+            time.sleep(remaining)
+        select_mux_channel(bus, sensor['channel'])
+        results[sensor['name']] = sht3x_fetch(bus, sensor['address'])
+    
+    return results
+
+def read_all_sensors(bus, sensors):
+    """
+    Read every sensor in sensors
+    
+    Sensors on separate I2C buses are read concurrently, one thread per
+    bus (an SMBus handle must not be shared between threads).
+    
+    Args:
+        bus: Open SMBus handle for I2C_BUS (the multiplexed bus)
+        sensors: Sensor configs to read
+    
+    Returns:
+        dict: Reading by sensor name
+    """
+    by_bus = {}
+    for sensor in sensors:
+        by_bus.setdefault(sensor.get('i2c_bus', I2C_BUS), []).append(sensor)
+    
+    if not by_bus:
+        return {}
+    if len(by_bus) == 1:
+        group, = by_bus.values()
+        return _read_bus_sensors(sensor_bus(bus, group[0]), group)
+    
+    results = {}
+    with ThreadPoolExecutor(max_workers=len(by_bus)) as executor:
+        futures = [
+            executor.submit(_read_bus_sensors, sensor_bus(bus, group[0]), group)
+            for group in by_bus.values()
+        ]
+        for future in futures:
+            results.update(future.result())
+    return results
@@ -9,64 +9,205 @@ Connected devices:
 
 import time
 import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
 
 try:
     import smbus2 as smbus
+    from smbus2 import i2c_msg
 except ImportError:
     import smbus
+    i2c_msg = None
+
+from i2c_shared import FastI2C, make_probes
 
 # I2C Configuration
 I2C_BUS = 1  # Default I2C bus for Raspberry Pi
 PCA9548A_ADDR = 0x70  # Default address for PCA9548A multiplexer
 
+# Section separator used in the report
+_BANNER = '=' * 60
+
 # Common sensor addresses
 TEMP_SENSOR_ADDRS = [0x48, 0x49, 0x4A, 0x4B]  # Common temp sensor addresses (like TMP102, LM75)
 TEMP_HUM_ADDRS = [0x40, 0x44, 0x76, 0x77]  # Common temp/humidity sensors (HTU21D, SHT31, BME280)
 OLED_ADDRS = [0x3C, 0x3D]  # Common OLED display addresses (SSD1306)
 
+# Device category and description for each known address. Listed in
+# lookup priority order - the first category claiming an address wins.
+DEVICE_KINDS = (
+    ('oled_displays', OLED_ADDRS, 'Likely OLED Display (SSD1306)'),
+    ('temperature_sensors', TEMP_SENSOR_ADDRS, 'Likely Temperature Sensor'),
+    ('temp_humidity_sensors', TEMP_HUM_ADDRS, 'Likely Temperature/Humidity Sensor'),
+)
+ADDR_TO_KIND = {
+    addr: (kind, label)
+    for kind, addrs, label in reversed(DEVICE_KINDS)
+    for addr in addrs
+}
+UNKNOWN_KIND = ('unknown', 'Unknown device')
+
+# Addresses of the devices we expect - probed before any full sweep
+KNOWN_ADDRS = frozenset(TEMP_SENSOR_ADDRS) | frozenset(TEMP_HUM_ADDRS) | frozenset(OLED_ADDRS)
+
+# Full 7-bit address sweep (used as a fallback)
+ALL_ADDRS = range(0x03, 0x78)
+
+# Concurrent probes per channel during a multiplexer scan
+SCAN_WORKERS = 8
+
+# Each channel carries at most a sensor and an OLED in this setup, so a
+# (non-exhaustive) channel scan stops once this many devices answer
+MAX_DEVICES_PER_CHANNEL = 2
+
 class PCA9548A:
     """PCA9548A I2C Multiplexer"""
     
-    def __init__(self, bus, address=0x70):
+    # Control byte for each channel
+    _CHAN_MASKS = {channel: 1 << channel for channel in range(8)}
+    
+    def __init__(self, bus, address=0x70, settle_us=0):
+        """
+        Args:
+            bus: Open SMBus handle
+            address: Multiplexer I2C address
+            settle_us: Delay after switching channels, for slow clones
+                       (the PCA9548A itself switches within the write)
+        """
         self.bus = bus
         self.address = address
+        self.settle = settle_us / 1e6
+        self.lock = threading.Lock()  # Hold while using the selected channel
+        self._mask = None  # Last control byte written (None = unknown)
+    
+    def _wait_switched(self, expected_mask, attempts=3):
+        """Read back the control register until it shows expected_mask"""
+        for _ in range(attempts):
+            if self.bus.read_byte(self.address) == expected_mask:
+                return True
+            time.sleep(0)  # Yield to other threads between reads
+        return False
+    
+    def _write_mask(self, mask):
+        """Write the control byte unless it is already set"""
+        if mask == self._mask:
+            return
+        self._mask = None  # Unknown until the write succeeds
+        self.bus.write_byte(self.address, mask)
+        
+        # Confirm the switch instead of sleeping a fixed time
+        if self.settle:
+            time.sleep(self.settle)
+        elif not self._wait_switched(mask):
+            time.sleep(0.001)
+        self._mask = mask
     
     def select_channel(self, channel):
         """Select a channel (0-7) on the multiplexer"""
-        if channel < 0 or channel > 7:
-            raise ValueError("Channel must be between 0 and 7")
-        self.bus.write_byte(self.address, 1 << channel)
-        time.sleep(0.01)  # Small delay for channel switching
+        try:
+            mask = self._CHAN_MASKS[channel]
+        except KeyError:
+            raise ValueError("Channel must be between 0 and 7") from None
+        self._write_mask(mask)
     
     def disable_all_channels(self):
         """Disable all channels"""
-        self.bus.write_byte(self.address, 0x00)
-        time.sleep(0.01)
+        self._write_mask(0x00)
     
     def get_current_channel(self):
         """Read current channel configuration"""
-        return self.bus.read_byte(self.address)
+        mask = self.bus.read_byte(self.address)
+        if mask != self._mask:
+            self._mask = None  # Changed behind our back - don't trust the cache
+        return mask
+
+
+def make_prober(bus):
+    """
+    Return probe(addr) -> bool, checking whether a device on bus ACKs addr
+    
+    Built on the shared i2c_shared.make_probes() probes, so the probe
+    method per address (quick write, or a read for READ_PROBE_ADDRS)
+    matches every other scan.
+    """
+    probes = dict(make_probes(bus, ALL_ADDRS))
+    
+    def probe(addr):
+        try:
+            probes[addr]()
+            return True
+        except OSError:
+            return False
+    
+    return probe
+
+
+def fd_scan(bus_num, addrs):
+    """
+    Probe addrs through a private raw i2c-dev handle (FastI2C)
+    
+    Bypasses the SMBus wrapper for the full sweep. A private handle is
+    used so the shared handle's cached target address stays valid.
+    
+    Returns:
+        int: Bitmask with bit addr set for every address that ACKed
+    
+    Raises:
+        OSError: If the i2c-dev device can't be opened
+    """
+    present = 0
+    fast = FastI2C(bus_num)
+    try:
+        for addr, probe in make_probes(fast, addrs):
+            try:
+                probe()
+            except OSError:
+                continue
+            present |= 1 << addr
+    finally:
+        fast.close()
+    return present
 
 
-def scan_i2c_bus(bus):
-    """Scan I2C bus for devices"""
-    devices = []
+def scan_i2c_bus(bus, full_scan=False):
+    """
+    Scan I2C bus for devices
+    
+    Only the multiplexer and known device addresses are probed, unless
+    nothing answers and full_scan is set.
+    """
+    probe = make_prober(bus)
+    
+    def probe_addrs(addrs):
+        devices = []
+        for addr in addrs:
+            if probe(addr):
+                devices.append(addr)
+                print(f"  Found device at 0x{addr:02X}")
+        return devices
+    
     print("Scanning I2C bus...")
-    for addr in range(0x03, 0x78):
+    devices = probe_addrs(sorted(KNOWN_ADDRS | {PCA9548A_ADDR}))
+    
+    if not devices and full_scan:
+        print("  No known devices - scanning full address range...")
         try:
-            bus.read_byte(addr)
-            devices.append(addr)
-            print(f"  Found device at 0x{addr:02X}")
-        except:
-            pass
+            present = fd_scan(I2C_BUS, ALL_ADDRS)
+        except OSError:
+            devices = probe_addrs(ALL_ADDRS)
+        else:
+            devices = [addr for addr in ALL_ADDRS if present >> addr & 1]
+            for addr in devices:
+                print(f"  Found device at 0x{addr:02X}")
+    
     return devices
 
 
 def test_multiplexer(bus, mux_addr):
     """Test PCA9548A multiplexer"""
-    print(f"\n{'='*60}")
+    print(f"\n{_BANNER}")
     print("Testing PCA9548A Multiplexer")
-    print(f"{'='*60}")
+    print(f"{_BANNER}")
     
     try:
         mux = PCA9548A(bus, mux_addr)
@@ -86,38 +227,97 @@ def test_multiplexer(bus, mux_addr):
         return None
 
 
-def scan_mux_channels(bus, mux, num_channels=8):
-    """Scan each channel of the multiplexer for devices"""
-    print(f"\n{'='*60}")
+def scan_mux_channels(bus, mux, num_channels=8, full_scan=False,
+                      expected_per_channel=None, exhaustive=False):
+    """
+    Scan each channel of the multiplexer for devices
+    
+    Only known device addresses are probed, unless a channel comes up
+    empty and full_scan is set. A channel's scan stops once
+    MAX_DEVICES_PER_CHANNEL devices have answered.
+    
+    Args:
+        expected_per_channel: Optional {channel: set of addresses}; listed
+                              channels probe only those addresses
+        exhaustive: Probe every address on every channel, without stopping
+                    early
+    """
+    print(f"\n{_BANNER}")
     print("Scanning Multiplexer Channels")
-    print(f"{'='*60}")
+    print(f"{_BANNER}")
     
     channel_devices = {}
+    known_addrs = sorted(KNOWN_ADDRS - {mux.address})
+    all_addrs = [addr for addr in ALL_ADDRS if addr != mux.address]
     
-    for channel in range(num_channels):
-        print(f"\nChannel {channel}:")
+    # The target address is per-handle state in the kernel, so each worker
+    # probes through its own SMBus handle rather than sharing `bus`
+    worker = threading.local()
+    worker_buses = []
+    
+    def worker_probe(addr):
+        if not hasattr(worker, 'probe'):
+            worker_bus = smbus.SMBus(I2C_BUS)
+            worker_buses.append(worker_bus)
+            worker.probe = make_prober(worker_bus)
+        return worker.probe(addr)
+    
+    def probe_channel(executor, addrs, limit):
+        """Probe addrs in parallel; stop once limit devices answer (0 = no limit)"""
+        futures = [executor.submit(worker_probe, addr) for addr in addrs]
+        devices = []
         try:
-            mux.select_channel(channel)
-            devices = []
-            
-            for addr in range(0x03, 0x78):
-                if addr == mux.address:
-                    continue
-                try:
-                    bus.read_byte(addr)
+            for addr, future in zip(addrs, futures):
+                if future.result():
                     devices.append(addr)
-                    print(f"  ✓ Device found at 0x{addr:02X}")
-                except:
-                    pass
-            
-            if not devices:
-                print("  (No devices found)")
-            
-            channel_devices[channel] = devices
-            
-        except Exception as e:
-            print(f"  ✗ Error scanning channel {channel}: {e}")
-            channel_devices[channel] = []
+                    if len(devices) == limit:
+                        break
+        finally:
+            # Drop the probes still queued and let running ones finish
+            # before the channel can be switched
+            for future in futures:
+                future.cancel()
+            wait(futures)
+        return devices
+    
+    limit = 0 if exhaustive else MAX_DEVICES_PER_CHANNEL
+    
+    # Report lines are collected and written once when the scan is done
+    lines = []
+    
+    try:
+        with ThreadPoolExecutor(max_workers=SCAN_WORKERS) as executor:
+            for channel in range(num_channels):
+                lines.append(f"\nChannel {channel}:")
+                try:
+                    # Keep the channel selected until every probe has finished
+                    with mux.lock:
+                        mux.select_channel(channel)
+                        if exhaustive:
+                            devices = probe_channel(executor, all_addrs, limit)
+                        elif expected_per_channel and channel in expected_per_channel:
+                            expected = sorted(expected_per_channel[channel])
+                            devices = probe_channel(executor, expected, limit)
+                        else:
+                            devices = probe_channel(executor, known_addrs, limit)
+                            if not devices and full_scan:
+                                devices = probe_channel(executor, all_addrs, limit)
+                    
+                    lines.extend(f"  ✓ Device found at 0x{addr:02X}" for addr in devices)
+                    
+                    if not devices:
+                        lines.append("  (No devices found)")
+                    
+                    channel_devices[channel] = devices
+                    
+                except Exception as e:
+                    lines.append(f"  ✗ Error scanning channel {channel}: {e}")
+                    channel_devices[channel] = []
+    finally:
+        for worker_bus in worker_buses:
+            worker_bus.close()
+        sys.stdout.write("\n".join(lines) + "\n")
+        sys.stdout.flush()
     
     mux.disable_all_channels()
     return channel_devices
@@ -128,10 +328,19 @@ def test_temperature_sensor(bus, mux, channel, addr):
     print(f"\n  Testing temperature sensor on channel {channel} at 0x{addr:02X}...")
     
     try:
+        # The PCA9548A only connects a channel after a STOP, so the mux
+        # write has to stay a separate transaction
         mux.select_channel(channel)
         
         # Try reading temperature (works for many sensors like LM75, TMP102)
-        data = bus.read_i2c_block_data(addr, 0x00, 2)
+        if i2c_msg is not None:
+            # Register pointer write + read as one combined transaction
+            # (repeated start, one ioctl)
+            read_msg = i2c_msg.read(addr, 2)
+            bus.i2c_rdwr(i2c_msg.write(addr, [0x00]), read_msg)
+            data = list(read_msg)
+        else:
+            data = bus.read_i2c_block_data(addr, 0x00, 2)
         temp = ((data[0] << 8) | data[1]) >> 4
         if temp > 2047:
             temp -= 4096
@@ -166,9 +375,9 @@ def test_oled_display(bus, mux, channel, addr):
 
 def identify_devices(channel_devices):
     """Try to identify what type of device is on each channel"""
-    print(f"\n{'='*60}")
+    print(f"\n{_BANNER}")
     print("Device Identification")
-    print(f"{'='*60}")
+    print(f"{_BANNER}")
     
     device_map = {
         'temperature_sensors': [],
@@ -183,65 +392,44 @@ def identify_devices(channel_devices):
             
         print(f"\nChannel {channel}:")
         for addr in devices:
-            if addr in OLED_ADDRS:
-                print(f"  0x{addr:02X} - Likely OLED Display (SSD1306)")
-                device_map['oled_displays'].append((channel, addr))
-            elif addr in TEMP_SENSOR_ADDRS:
-                print(f"  0x{addr:02X} - Likely Temperature Sensor")
-                device_map['temperature_sensors'].append((channel, addr))
-            elif addr in TEMP_HUM_ADDRS:
-                print(f"  0x{addr:02X} - Likely Temperature/Humidity Sensor")
-                device_map['temp_humidity_sensors'].append((channel, addr))
-            else:
-                print(f"  0x{addr:02X} - Unknown device")
-                device_map['unknown'].append((channel, addr))
+            kind, label = ADDR_TO_KIND.get(addr, UNKNOWN_KIND)
+            print(f"  0x{addr:02X} - {label}")
+            device_map[kind].append((channel, addr))
     
     return device_map
 
 
 def run_functional_tests(bus, mux, device_map):
     """Run functional tests on identified devices"""
-    print(f"\n{'='*60}")
+    print(f"\n{_BANNER}")
     print("Functional Tests")
-    print(f"{'='*60}")
+    print(f"{_BANNER}")
     
     results = {'passed': 0, 'failed': 0}
     
-    # Test temperature sensors
-    if device_map['temperature_sensors']:
-        print("\nTesting Temperature Sensors:")
-        for channel, addr in device_map['temperature_sensors']:
-            if test_temperature_sensor(bus, mux, channel, addr):
-                results['passed'] += 1
-            else:
-                results['failed'] += 1
-    
-    # Test OLED displays
-    if device_map['oled_displays']:
-        print("\nTesting OLED Displays:")
-        for channel, addr in device_map['oled_displays']:
-            if test_oled_display(bus, mux, channel, addr):
-                results['passed'] += 1
-            else:
-                results['failed'] += 1
-    
-    # Test temp/humidity sensors
-    if device_map['temp_humidity_sensors']:
-        print("\nTesting Temperature/Humidity Sensors:")
-        for channel, addr in device_map['temp_humidity_sensors']:
-            if test_temperature_sensor(bus, mux, channel, addr):
-                results['passed'] += 1
-            else:
-                results['failed'] += 1
+    tests = (
+        [(channel, addr, test_temperature_sensor) for channel, addr in device_map['temperature_sensors']] +
+        [(channel, addr, test_oled_display) for channel, addr in device_map['oled_displays']] +
+        [(channel, addr, test_temperature_sensor) for channel, addr in device_map['temp_humidity_sensors']]
+    )
+    
+    # Run tests grouped by channel so each channel is only selected once
+    tests.sort(key=lambda test: test[0])
+    
+    for channel, addr, test_func in tests:
+        if test_func(bus, mux, channel, addr):
+            results['passed'] += 1
+        else:
+            results['failed'] += 1
     
     return results
 
 
 def print_summary(device_map, test_results):
     """Print test summary"""
-    print(f"\n{'='*60}")
+    print(f"\n{_BANNER}")
     print("TEST SUMMARY")
-    print(f"{'='*60}")
+    print(f"{_BANNER}")
     
     total_devices = sum(len(devices) for devices in device_map.values())
     print(f"\nTotal devices found: {total_devices}")
@@ -254,15 +442,24 @@ def print_summary(device_map, test_results):
     print(f"  ✓ Passed: {test_results['passed']}")
     print(f"  ✗ Failed: {test_results['failed']}")
     
-    print(f"\n{'='*60}")
+    print(f"\n{_BANNER}")
 
 
 def main():
     """Main test routine"""
-    print(f"{'='*60}")
+    import argparse
+    
+    parser = argparse.ArgumentParser(description='Test I2C setup with PCA9548A multiplexer')
+    parser.add_argument('--full-scan', action='store_true',
+                        help='Sweep the whole address range when no known device answers')
+    parser.add_argument('--exhaustive', action='store_true',
+                        help='Probe every address on every multiplexer channel')
+    args = parser.parse_args()
+    
+    print(f"{_BANNER}")
     print("I2C Setup Test Script")
     print("PCA9548A Multiplexer with Sensors and Displays")
-    print(f"{'='*60}")
+    print(f"{_BANNER}")
     
     try:
         # Initialize I2C bus
@@ -271,7 +468,7 @@ def main():
         print("✓ I2C bus initialized")
         
         # Scan main I2C bus
-        main_devices = scan_i2c_bus(bus)
+        main_devices = scan_i2c_bus(bus, full_scan=args.full_scan)
         
         if not main_devices:
             print("\n✗ No I2C devices found on main bus!")
@@ -287,7 +484,8 @@ def main():
             return 1
         
         # Scan all channels
-        channel_devices = scan_mux_channels(bus, mux)
+        channel_devices = scan_mux_channels(bus, mux, full_scan=args.full_scan,
+                                            exhaustive=args.exhaustive)
         
         # Identify devices
         device_map = identify_devices(channel_devices)
@@ -6,26 +6,60 @@ Tests connection to Bigtreetech Octopus Pro V1.0 via Moonraker API
 
 import sys
 import time
-import json
 import os
+import atexit
+from concurrent.futures import ThreadPoolExecutor
+
+# Moonraker replies are always UTF-8 JSON, so parse the raw bytes directly
+# (orjson when available - the objects query can be tens of KB)
+try:
+    import orjson
+    _loads = orjson.loads
+except ImportError:
+    import json
+    _loads = json.loads
 
 try:
     import requests
+    from requests.adapters import HTTPAdapter
     REQUESTS_AVAILABLE = True
 except ImportError:
     REQUESTS_AVAILABLE = False
 
 MOONRAKER_URL = "http://localhost:7125"
 
+# (connect, read) timeouts - fail fast when Moonraker isn't listening,
+# but give a busy Klipper time to answer
+HTTP_TIMEOUT = (0.5, 2.0)
+
+# Shorter timeouts for the reachability preflight
+PREFLIGHT_TIMEOUT = (0.3, 1.0)
+
+# Substrings that mark a /dev/serial/by-id entry as a likely Klipper MCU
+KLIPPER_SERIAL_TAGS = ('Klipper', 'STM32', 'BigTreeTech', 'usb')
+
+# MCU object names per Moonraker URL: url -> (monotonic time, names)
+MCU_OBJECTS_TTL = 60.0
+_MCU_OBJECTS_CACHE = {}
+
+# Keep-alive session so the checks in run_test share one connection.
+# The helpers below assume requests is installed - run_test and main
+# check REQUESTS_AVAILABLE before calling any of them.
+if REQUESTS_AVAILABLE:
+    _SESSION = requests.Session()
+    _SESSION.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=4))
+    atexit.register(_SESSION.close)
+
 def check_moonraker_connection():
     """Check if Moonraker API is accessible"""
-    if not REQUESTS_AVAILABLE:
-        return {'success': False, 'error': 'requests library not installed'}
-    
     try:
-        response = requests.get(f"{MOONRAKER_URL}/printer/info", timeout=2.0)
+        # Cheap preflight first, so a down service fails fast. Any HTTP
+        # reply (even 405 for HEAD) means Moonraker is up.
+        _SESSION.head(f"{MOONRAKER_URL}/server/info", timeout=PREFLIGHT_TIMEOUT)
+        
+        response = _SESSION.get(f"{MOONRAKER_URL}/printer/info", timeout=HTTP_TIMEOUT)
         if response.status_code == 200:
-            data = response.json()
+            data = _loads(response.content)
             return {
                 'success': True,
                 'data': data,
@@ -46,33 +80,56 @@ def check_moonraker_connection():
     except Exception as e:
         return {'success': False, 'error': str(e)}
 
+def list_mcu_objects():
+    """
+    List the MCU objects in the Klipper config
+    
+    The list only changes when the config does, so it is cached per
+    Moonraker URL for MCU_OBJECTS_TTL seconds.
+    
+    Returns:
+        list: MCU object names, or None if the list request failed
+    """
+    cached = _MCU_OBJECTS_CACHE.get(MOONRAKER_URL)
+    if cached is not None and time.monotonic() - cached[0] < MCU_OBJECTS_TTL:
+        return cached[1]
+    
+    response = _SESSION.get(f"{MOONRAKER_URL}/printer/objects/list", timeout=HTTP_TIMEOUT)
+    if response.status_code != 200:
+        return None
+    
+    objects = _loads(response.content).get('result', {}).get('objects', [])
+    mcu_objs = [obj for obj in objects if obj.startswith('mcu')]
+    
+    _MCU_OBJECTS_CACHE[MOONRAKER_URL] = (time.monotonic(), mcu_objs)
+    return mcu_objs
+
 def check_mcu_status():
     """Check MCU status via Klipper Object Model"""
-    if not REQUESTS_AVAILABLE:
-        return {'success': False}
-
     try:
-        # First list objects to find the mcu
-        response = requests.get(f"{MOONRAKER_URL}/printer/objects/list", timeout=2.0)
-        if response.status_code != 200:
+        # First list objects to find the mcu (cached after the first call)
+        mcu_objs = list_mcu_objects()
+        if mcu_objs is None:
             return {'success': False, 'error': 'Failed to list objects'}
-            
-        objects = response.json().get('result', {}).get('objects', [])
-        mcu_objs = [obj for obj in objects if obj.startswith('mcu')]
         
         if not mcu_objs:
+            _MCU_OBJECTS_CACHE.pop(MOONRAKER_URL, None)
             return {'success': False, 'error': 'No MCU objects found in Klipper config'}
             
         # Query the MCUs found
         query_str = "&".join(mcu_objs)
-        response = requests.get(f"{MOONRAKER_URL}/printer/objects/query?{query_str}", timeout=2.0)
+        response = _SESSION.get(f"{MOONRAKER_URL}/printer/objects/query?{query_str}", timeout=HTTP_TIMEOUT)
         
         if response.status_code == 200:
-            data = response.json().get('result', {}).get('status', {})
+            data = _loads(response.content).get('result', {}).get('status', {})
+            if set(mcu_objs) - set(data):
+                # Config changed since the list was cached - refresh next time
+                _MCU_OBJECTS_CACHE.pop(MOONRAKER_URL, None)
             return {
                 'success': True,
                 'mcus': data
             }
+        _MCU_OBJECTS_CACHE.pop(MOONRAKER_URL, None)
         return {'success': False, 'error': 'Failed to query MCU status'}
         
     except Exception as e:
@@ -80,14 +137,11 @@ def check_mcu_status():
 
 def send_gcode_command(command):
     """Send a G-code command to Klipper"""
-    if not REQUESTS_AVAILABLE:
-        return {'success': False}
-        
     try:
-        response = requests.post(
+        response = _SESSION.post(
             f"{MOONRAKER_URL}/printer/gcode/script", 
             json={'script': command},
-            timeout=2.0
+            timeout=HTTP_TIMEOUT
         )
         
         if response.status_code == 200:
@@ -101,16 +155,21 @@ def send_gcode_command(command):
 def check_usb_devices():
     """Check for connected USB serial devices (Klipper MCUs)"""
     serial_path = "/dev/serial/by-id"
-    if not os.path.exists(serial_path):
-        return {'success': False, 'message': 'No serial devices found (no /dev/serial/by-id)'}
-        
+    
+    # Single pass: collect every device and the likely candidates together
+    devices = []
+    klipper_devs = []
     try:
-        devices = os.listdir(serial_path)
+        with os.scandir(serial_path) as entries:
+            for entry in entries:
+                name = entry.name
+                devices.append(name)
+                if any(tag in name for tag in KLIPPER_SERIAL_TAGS):
+                    klipper_devs.append(name)
+    except FileNotFoundError:
+        return {'success': False, 'message': 'No serial devices found (no /dev/serial/by-id)'}
     except OSError:
         return {'success': False, 'message': 'Could not list /dev/serial/by-id'}
-
-    # Filter for likely candidates
-    klipper_devs = [d for d in devices if 'Klipper' in d or 'STM32' in d or 'BigTreeTech' in d or 'usb' in d]
     
     if klipper_devs:
         return {
@@ -159,8 +218,14 @@ def run_test(quick=False, mock=False):
         result['message'] = 'Missing dependencies'
         return result
         
-    # 1. Check Connection & Info
-    conn_result = check_moonraker_connection()
+    # 1. Check Connection & Info, and 2. MCU status
+    # Both are read-only and independent, so run them concurrently
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        conn_future = executor.submit(check_moonraker_connection)
+        mcu_future = executor.submit(check_mcu_status)
+        conn_result = conn_future.result()
+        mcu_result = mcu_future.result()
+    
     result['klipper']['connection'] = conn_result
     
     if not conn_result['success']:
@@ -181,8 +246,9 @@ def run_test(quick=False, mock=False):
             
         return result
         
-    klipper_state = conn_result['data'].get('result', {}).get('state', 'unknown')
-    klipper_msg = conn_result['data'].get('result', {}).get('state_message', '')
+    info = conn_result['data'].get('result') or {}
+    klipper_state = info.get('state', 'unknown')
+    klipper_msg = info.get('state_message', '')
     
     result['klipper']['state'] = klipper_state
     
@@ -192,8 +258,7 @@ def run_test(quick=False, mock=False):
         if klipper_msg:
             result['message'] += f" ({klipper_msg})"
     
-    # 2. Check MCU Status
-    mcu_result = check_mcu_status()
+    # 2. MCU Status (fetched above)
     result['klipper']['mcu'] = mcu_result
     
     if mcu_result['success']:
@@ -236,13 +301,15 @@ def main():
     print(f"\nStatus: {result['status'].upper()}")
     print(f"Message: {result['message']}")
     
-    if result.get('klipper', {}).get('connection', {}).get('success'):
-        state = result['klipper'].get('state', 'unknown')
+    klipper = result.get('klipper') or {}
+    if (klipper.get('connection') or {}).get('success'):
+        state = klipper.get('state', 'unknown')
         print(f"Klipper State: {state}")
         
-        if result['klipper'].get('mcu', {}).get('success'):
+        mcu_status = klipper.get('mcu') or {}
+        if mcu_status.get('success'):
             print("\nMCU Status:")
-            for name, status in result['klipper']['mcu']['mcus'].items():
+            for name, status in mcu_status['mcus'].items():
                 print(f"  {name}:")
                 print(f"    Version: {status.get('mcu_version', 'unknown')}")
                 print(f"    Load: {status.get('last_stats', {}).get('mcu_task_avg', 0):.1f}%")
@@ -4,8 +4,12 @@ Microphone Test Module
 Tests USB microphone connectivity and audio capture
 """
 
+import re
 import sys
+import math
 import time
+import threading
+from concurrent.futures import Future
 
 try:
     import sounddevice as sd
@@ -14,31 +18,59 @@ try:
 except ImportError:
     SOUNDDEVICE_AVAILABLE = False
 
+# Name fragments of common USB microphones
+_USB_MIC_RE = re.compile(r'usb|webcam|c920|blue|yeti|microphone', re.IGNORECASE)
+
+# Result of the last sd.query_devices() call (None = not enumerated yet).
+# Enumerating re-scans ALSA/PulseAudio, so the list is reused for
+# _CACHE_TTL seconds - repeated runs in one session skip it.
+_DEVICES_CACHE = None
+_CACHE_TIME = 0.0
+_CACHE_TTL = 30.0
+
+def _get_devices(force=False):
+    """Return the audio device list, re-enumerating when stale (or if force)"""
+    global _DEVICES_CACHE, _CACHE_TIME
+    now = time.monotonic()
+    if force or _DEVICES_CACHE is None or now - _CACHE_TIME >= _CACHE_TTL:
+        _DEVICES_CACHE = sd.query_devices()
+        _CACHE_TIME = now
+    return _DEVICES_CACHE
+
+def invalidate_device_cache():
+    """Forget the cached device list (e.g. after a USB hotplug event)"""
+    global _DEVICES_CACHE
+    _DEVICES_CACHE = None
+
 def list_audio_devices():
     """List all available audio devices"""
     if not SOUNDDEVICE_AVAILABLE:
         return None
     
     try:
-        devices = sd.query_devices()
-        return devices
+        return _get_devices()
     except Exception as e:
         return None
 
-def find_usb_microphone():
-    """Find USB microphone device"""
+def find_usb_microphone(devices=None):
+    """
+    Find USB microphone device
+    
+    Args:
+        devices: Device list to search (default: the cached enumeration)
+    """
     if not SOUNDDEVICE_AVAILABLE:
         return None, "sounddevice not installed"
     
     try:
-        devices = sd.query_devices()
+        if devices is None:
+            devices = _get_devices()
         
         # Look for USB microphone (input devices)
         for idx, device in enumerate(devices):
-            name = device['name'].lower()
             if device['max_input_channels'] > 0:
                 # Common USB mic indicators
-                if any(keyword in name for keyword in ['usb', 'webcam', 'c920', 'blue', 'yeti', 'microphone']):
+                if _USB_MIC_RE.search(device['name']):
                     return idx, device
         
         # If no USB mic found by name, return first input device
@@ -51,68 +83,137 @@ def find_usb_microphone():
     except Exception as e:
         return None, str(e)
 
-def test_microphone_basic(device_idx):
-    """Test basic microphone connectivity"""
-    if not SOUNDDEVICE_AVAILABLE:
-        return {'success': False, 'error': 'sounddevice not installed'}
+def start_microphone_capture(device_idx, duration, device_info=None):
+    """
+    Start recording from the microphone in the background
+    
+    Levels are accumulated block by block as PortAudio delivers audio
+    (no full-length buffer), and a timer stops the stream after duration
+    seconds, so the caller is free to run other tests meanwhile.
+    
+    Args:
+        device_idx: Input device index
+        duration: Seconds to record
+        device_info: Device dict from the enumeration (looked up if None)
+    
+    Returns:
+        Future: Resolves to (rms, peak, has_signal)
+    
+    Raises:
+        Exception: If the device can't be opened (raised here, not by the future)
+    """
+    if device_info is None:
+        device_info = _get_devices()[device_idx]
+    
+    sum_sq = 0.0
+    frames_seen = 0
+    peak = 0.0
+    
+    def callback(indata, frames, time_info, status):
+        nonlocal sum_sq, frames_seen, peak
+        block = indata[:, 0]
+        sum_sq += float(np.dot(block, block))
+        frames_seen += frames
+        peak = max(peak, float(block.max()), float(-block.min()))
+    
+    stream = sd.InputStream(
+        samplerate=int(device_info['default_samplerate']),
+        channels=1,
+        device=device_idx,
+        dtype='float32',
+        blocksize=1024,
+        callback=callback
+    )
+    future = Future()
+    
+    def finish():
+        try:
+            stream.stop()
+            stream.close()
+            if not frames_seen:
+                raise RuntimeError('No audio captured')
+            rms = math.sqrt(sum_sq / frames_seen)
+            has_signal = rms > 0.001  # Threshold for detecting audio
+            future.set_result((rms, peak, has_signal))
+        except Exception as e:
+            future.set_exception(e)
     
     try:
-        device_info = sd.query_devices(device_idx)
-        
-        # Try to open the device
-        with sd.InputStream(device=device_idx, channels=1):
-            pass
-        
-        return {
-            'success': True,
-            'name': device_info['name'],
-            'channels': device_info['max_input_channels'],
-            'sample_rate': device_info['default_samplerate']
-        }
-        
-    except Exception as e:
-        return {'success': False, 'error': str(e)}
+        stream.start()
+    except Exception:
+        stream.close()
+        raise
+    
+    timer = threading.Timer(duration, finish)
+    timer.daemon = True
+    timer.start()
+    return future
 
-def test_microphone_audio(device_idx, duration=2.0):
-    """Test actual audio capture and level detection"""
+def test_microphone_capture(device_idx, device_info=None, duration=0.0):
+    """
+    Open the microphone once and optionally capture audio from it
+    
+    PortAudio/ALSA negotiate the format on every open, so the connectivity
+    check and the recording share a single stream.
+    
+    Args:
+        device_idx: Input device index
+        device_info: Device dict from the enumeration (looked up if None)
+        duration: Seconds to record; 0 only checks the device opens
+    
+    Returns:
+        dict: Device details, plus audio levels when duration > 0.
+              On a capture failure after the device opened, 'accessible'
+              is True.
+    """
     if not SOUNDDEVICE_AVAILABLE:
         return {'success': False, 'error': 'sounddevice not installed'}
     
     try:
-        device_info = sd.query_devices(device_idx)
-        sample_rate = int(device_info['default_samplerate'])
-        
-        print(f"  Recording {duration}s of audio (speak into the microphone)...")
-        
-        # Record audio
-        recording = sd.rec(
-            int(duration * sample_rate),
-            samplerate=sample_rate,
-            channels=1,
-            device=device_idx,
-            dtype='float32'
-        )
-        sd.wait()
-        
-        # Analyze audio
-        audio_data = recording.flatten()
-        rms = np.sqrt(np.mean(audio_data**2))
-        peak = np.max(np.abs(audio_data))
-        
-        # Check if we got any signal
-        has_signal = rms > 0.001  # Threshold for detecting audio
-        
-        return {
-            'success': True,
-            'rms_level': float(rms),
-            'peak_level': float(peak),
-            'has_signal': has_signal,
-            'sample_rate': sample_rate,
-            'duration': duration
-        }
+        if device_info is None:
+            device_info = _get_devices()[device_idx]
         
+        # Opening the stream is the connectivity check
+        if duration:
+            print(f"  Recording {duration}s of audio (speak into the microphone)...")
+            capture = start_microphone_capture(device_idx, duration, device_info)
+        else:
+            with sd.InputStream(device=device_idx, channels=1):
+                pass
     except Exception as e:
         return {'success': False, 'error': str(e)}
+    
+    result = {
+        'success': True,
+        'name': device_info['name'],
+        'channels': device_info['max_input_channels'],
+        'sample_rate': device_info['default_samplerate']
+    }
+    
+    if not duration:
+        return result
+    
+    try:
+        rms, peak, has_signal = capture.result()
+    except Exception as e:
+        return {'success': False, 'accessible': True, 'error': str(e)}
+    
+    result.update({
+        'rms_level': rms,
+        'peak_level': peak,
+        'has_signal': has_signal,
+        'sample_rate': int(device_info['default_samplerate']),
+        'duration': duration
+    })
+    return result
+
+def test_microphone_basic(device_idx, device_info=None):
+    """Test basic microphone connectivity"""
+    return test_microphone_capture(device_idx, device_info)
+
+def test_microphone_audio(device_idx, duration=2.0, device_info=None):
+    """Test actual audio capture and level detection"""
+    return test_microphone_capture(device_idx, device_info, duration)
 
 def run_test(quick=True):
     """
@@ -145,39 +246,35 @@ def run_test(quick=True):
         mic_idx, mic_info = find_usb_microphone()
         
         if mic_idx is None:
+            invalidate_device_cache()
             result['error'] = mic_info
             result['message'] = 'No microphone found'
             return result
         
-        # Test basic connectivity
-        basic_test = test_microphone_basic(mic_idx)
-        result['microphone'] = basic_test
+        # Test connectivity, and audio capture unless in quick mode, with
+        # a single open of the device
+        mic_test = test_microphone_capture(mic_idx, mic_info, duration=0.0 if quick else 2.0)
+        result['microphone'] = mic_test
         
-        if not basic_test['success']:
-            result['error'] = basic_test.get('error', 'Unknown error')
-            result['message'] = 'Microphone not accessible'
+        if not mic_test['success']:
+            result['error'] = mic_test.get('error', 'Unknown error')
+            if mic_test.get('accessible'):
+                result['message'] = 'Audio capture failed'
+            else:
+                # The device may have been unplugged - enumerate afresh next run
+                invalidate_device_cache()
+                result['message'] = 'Microphone not accessible'
             return result
         
-        # Test audio capture (if not quick mode)
-        if not quick:
-            audio_test = test_microphone_audio(mic_idx, duration=2.0)
-            
-            if audio_test['success']:
-                result['microphone'].update(audio_test)
-                
-                if audio_test.get('has_signal'):
-                    result['status'] = 'pass'
-                    result['message'] = f"Microphone working | RMS: {audio_test['rms_level']:.4f}"
-                else:
-                    result['status'] = 'pass'  # Still pass, just low signal
-                    result['message'] = f"Microphone connected but low/no signal detected"
-            else:
-                result['error'] = audio_test.get('error', 'Audio test failed')
-                result['message'] = 'Audio capture failed'
-        else:
+        result['status'] = 'pass'
+        if quick:
             # Quick mode - just check connectivity
-            result['status'] = 'pass'
-            result['message'] = f"Microphone detected: {basic_test['name']}"
+            result['message'] = f"Microphone detected: {mic_test['name']}"
+        elif mic_test['has_signal']:
+            result['message'] = f"Microphone working | RMS: {mic_test['rms_level']:.4f}"
+        else:
+            # Still pass, just low signal
+            result['message'] = "Microphone connected but low/no signal detected"
         
     except Exception as e:
         result['status'] = 'fail'
@@ -211,7 +308,7 @@ def main():
     print()
     
     # Find and test microphone
-    mic_idx, mic_info = find_usb_microphone()
+    mic_idx, mic_info = find_usb_microphone(devices)
     
     if mic_idx is None:
         print(f"✗ No microphone found: {mic_info}")
@@ -225,7 +322,7 @@ def main():
     
     # Test basic connectivity
     print("Testing Basic Connectivity...")
-    basic_test = test_microphone_basic(mic_idx)
+    basic_test = test_microphone_basic(mic_idx, mic_info)
     
     if basic_test['success']:
         print("✓ Microphone accessible")
@@ -246,7 +343,7 @@ def main():
         print("Audio Recording Test")
         print("="*60)
         
-        audio_test = test_microphone_audio(mic_idx, duration=2.0)
+        audio_test = test_microphone_audio(mic_idx, duration=2.0, device_info=mic_info)
         
         if audio_test['success']:
             print(f"\n✓ Recording successful!")
@@ -4,18 +4,39 @@ I2C Multiplexer Test Module
 Tests PCA9548A multiplexer connectivity
 """
 
-try:
-    import smbus2 as smbus
-except ImportError:
-    import smbus
+from i2c_shared import get_fast_bus, select_channel, disable_channels, make_probes
 
 I2C_BUS = 1
 MUX_ADDR = 0x70
 
-def run_test():
+# Addresses of device types wired (or likely to be wired) to this robot -
+# probed instead of the whole 7-bit range unless full_scan is set.
+# Update this list when new hardware is added.
+KNOWN_ADDRS = (
+    0x1D,        # ADXL345 / LSM303 accelerometer
+    0x29,        # VL53L0X distance sensor
+    0x3C, 0x3D,  # SH1106/SSD1306 OLEDs (test_oled.OLEDS)
+    0x44, 0x45,  # SHT3x temperature/humidity (test_temperature.SENSORS)
+    0x48,        # ADS1115 ADC / TMP102
+    0x68, 0x69,  # MPU-6050 / MPU-9250 IMU
+    0x76, 0x77,  # BME280/BMP280 (test_temperature.SENSORS)
+)
+
+def _acks(probe):
+    """Run a probe from make_probes; True if the device ACKed"""
+    try:
+        probe()
+        return True
+    except OSError:
+        return False
+
+def run_test(full_scan=False):
     """
     Test PCA9548A multiplexer
     
+    Args:
+        full_scan: Probe the whole 7-bit address range instead of KNOWN_ADDRS
+    
     Returns:
         dict: {
             'status': 'pass'/'fail',
@@ -31,7 +52,7 @@ def run_test():
     }
     
     try:
-        bus = smbus.SMBus(I2C_BUS)
+        bus = get_fast_bus(I2C_BUS)
         
         # Test multiplexer
         try:
@@ -43,28 +64,24 @@ def run_test():
             return result
         
         # Scan each channel
+        # Probes are plain zero-length write()s (a 1-byte read() for
+        # EEPROM-style addresses) on the raw i2c-dev fd, built once and
+        # reused on every channel
+        probes = make_probes(bus) if full_scan else make_probes(bus, KNOWN_ADDRS)
         total_devices = 0
         for ch in range(8):
-            bus.write_byte(MUX_ADDR, 1 << ch)
+            select_channel(bus, ch)
             
-            devices = []
-            for addr in range(0x03, 0x78):
-                if addr == MUX_ADDR:
-                    continue
-                try:
-                    bus.read_byte(addr)
-                    devices.append(f"0x{addr:02X}")
-                except:
-                    pass
+            found = [addr for addr, probe in probes if _acks(probe)]
             
-            result['channels'][ch] = devices
-            total_devices += len(devices)
+            result['channels'][ch] = [f"0x{addr:02X}" for addr in found]
+            total_devices += len(found)
         
         # Disable all channels
-        bus.write_byte(MUX_ADDR, 0x00)
-        bus.close()
+        disable_channels(bus)
         
-        result['message'] += f" | {total_devices} devices found across {len([c for c in result['channels'].values() if c])} channels"
+        active_channels = sum(1 for devices in result['channels'].values() if devices)
+        result['message'] += f" | {total_devices} devices found across {active_channels} channels"
         
     except Exception as e:
         result['status'] = 'fail'
@@ -6,10 +6,7 @@ Tests SH1107/SH1106 OLED displays via PCA9548A multiplexer
 
 import time
 
-try:
-    import smbus2 as smbus
-except ImportError:
-    import smbus
+from i2c_shared import get_fast_bus, select_channel, disable_channels
 
 try:
     from luma.core.interface.serial import i2c
@@ -30,8 +27,7 @@ OLEDS = [
 
 def select_mux_channel(bus, channel):
     """Select channel on PCA9548A multiplexer"""
-    bus.write_byte(MUX_ADDR, 1 << channel)
-    time.sleep(0.02)
+    select_channel(bus, channel, verify=True)
 
 def test_oled_basic(bus, channel, addr):
     """Basic OLED communication test"""
@@ -48,9 +44,8 @@ def test_oled_display(channel, addr, name, quick=True):
         return {'success': False, 'error': 'luma.oled not installed'}
     
     try:
-        bus = smbus.SMBus(I2C_BUS)
+        bus = get_fast_bus(I2C_BUS)
         select_mux_channel(bus, channel)
-        time.sleep(0.05)
         
         serial = i2c(port=I2C_BUS, address=addr)
         device = sh1106(serial, width=128, height=128, rotate=0)
@@ -63,7 +58,6 @@ def test_oled_display(channel, addr, name, quick=True):
         time.sleep(0.5 if quick else 2.0)
         device.clear()
         
-        bus.close()
         return {'success': True, 'message': 'Display working'}
         
     except Exception as e:
@@ -91,7 +85,7 @@ def run_test(visual=False):
     }
     
     try:
-        bus = smbus.SMBus(I2C_BUS)
+        bus = get_fast_bus(I2C_BUS)
         
         passed = 0
         failed = 0
@@ -108,18 +102,17 @@ def run_test(visual=False):
                     oled['name'],
                     quick=True
                 )
-                result['displays'][oled['name']] = display_result
             else:
-                result['displays'][oled['name']] = basic_result
+                display_result = basic_result
             
-            if result['displays'][oled['name']]['success']:
+            result['displays'][oled['name']] = display_result
+            if display_result['success']:
                 passed += 1
             else:
                 failed += 1
         
         # Disable mux
-        bus.write_byte(MUX_ADDR, 0x00)
-        bus.close()
+        disable_channels(bus)
         
         if failed > 0:
             result['status'] = 'fail'
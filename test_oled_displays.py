@@ -4,17 +4,19 @@ OLED Display Test for SH1107 (128x128) via PCA9548A multiplexer
 Compatible with skipper-face-tracker setup
 """
 
+import sys
 import time
-try:
-    import smbus2 as smbus
-except ImportError:
-    import smbus
+import threading
+
+from i2c_shared import get_bus, select_channel, disable_channels
 
 try:
     from luma.core.interface.serial import i2c
-    from luma.core.render import canvas
     from luma.oled.device import sh1106  # SH1106 is compatible with SH1107
-    from PIL import ImageFont
+    from PIL import Image, ImageDraw, ImageFont
+    # Loaded once - load_default() returns a new font object per call,
+    # which would defeat the text mask cache below
+    FONT = ImageFont.load_default()
     LUMA_AVAILABLE = True
 except ImportError:
     print("⚠ luma.oled not installed. Install with: pip3 install luma.core luma.oled pillow")
@@ -29,15 +31,21 @@ OLED_CONFIGS = [
     {'channel': 3, 'address': 0x3C, 'name': 'OLED 2'}
 ]
 
+# Held while a display's channel is selected and written, so displays
+# tested in parallel threads don't switch the mux under each other
+BUS_LOCK = threading.Lock()
+
+# Initialized luma devices by (channel, address) - creating one opens the
+# I2C port and sends the init sequence, so it is done once per display
+_DEVICES = {}
+
 def select_mux_channel(bus, channel):
     """Select channel on PCA9548A multiplexer"""
-    bus.write_byte(MUX_ADDR, 1 << channel)
-    time.sleep(0.02)
+    select_channel(bus, channel, verify=True)
 
 def disable_mux_channels(bus):
     """Disable all multiplexer channels"""
-    bus.write_byte(MUX_ADDR, 0x00)
-    time.sleep(0.02)
+    disable_channels(bus)
 
 def test_oled_basic(bus, channel, addr, name):
     """Basic OLED communication test"""
@@ -54,92 +62,161 @@ def test_oled_basic(bus, channel, addr, name):
         print(f"  ✗ {name} not responding: {e}")
         return False
 
-def test_oled_display(channel, addr, name):
+def get_display(bus, channel, addr):
+    """
+    Select channel and return the luma device for the display at addr
+    
+    The device is created (and the display initialized) on first use only.
+    """
+    select_mux_channel(bus, channel)
+    
+    device = _DEVICES.get((channel, addr))
+    if device is None:
+        # Initialize SH1106 device (compatible with SH1107)
+        serial = i2c(port=I2C_BUS, address=addr)
+        device = sh1106(serial, width=128, height=128, rotate=0)
+        _DEVICES[(channel, addr)] = device
+    return device
+
+def close_displays(bus):
+    """Switch off every initialized display and release its I2C port"""
+    for (channel, addr), device in _DEVICES.items():
+        try:
+            select_mux_channel(bus, channel)
+            device.cleanup()
+        except Exception as e:
+            print(f"  ⚠ Cleanup failed for display on channel {channel}: {e}")
+    _DEVICES.clear()
+
+# Rasterized text masks by (text, font), shared by every frame and display
+_TEXT_CACHE = {}
+
+def paste_text(image, xy, text, font, fill="white"):
+    """
+    Draw text onto image from a cached glyph mask
+    
+    Equivalent to ImageDraw.text(), but each string is rasterized only
+    once - repeats are a single paste.
+    """
+    mask = _TEXT_CACHE.get((text, font))
+    if mask is None:
+        # Measure in 1-bit mode - unhinted (antialiased) metrics can be
+        # narrower than the rendered glyphs
+        mask = Image.new('1', (1, 1))
+        left, top, right, bottom = ImageDraw.Draw(mask).textbbox((0, 0), text, font=font)
+        mask = Image.new('1', (right, bottom))
+        ImageDraw.Draw(mask).text((0, 0), text, fill=1, font=font)
+        _TEXT_CACHE[(text, font)] = mask
+    image.paste(fill, (xy[0], xy[1]), mask)
+
+def _log(message):
+    """Print message as one write, so lines from parallel display tests don't interleave"""
+    sys.stdout.write(message + "\n")
+    sys.stdout.flush()
+
+def test_oled_display(bus, channel, addr, name):
     """Test OLED with luma library (SH1107/SH1106 128x128)"""
     if not LUMA_AVAILABLE:
         return False
     
-    print(f"\n  Testing display functionality for {name}...")
+    _log(f"\n  Testing display functionality for {name}...")
     
     try:
-        # Create device with multiplexer channel switching
-        # Note: luma.oled handles I2C, but we need mux switching
-        bus = smbus.SMBus(I2C_BUS)
-        select_mux_channel(bus, channel)
-        time.sleep(0.05)
+        # luma.oled handles I2C, but we need mux switching
+        with BUS_LOCK:
+            device = get_display(bus, channel, addr)
         
-        # Initialize SH1106 device (compatible with SH1107)
-        serial = i2c(port=I2C_BUS, address=addr)
-        device = sh1106(serial, width=128, height=128, rotate=0)
+        def show(image):
+            """Select this display's channel and push image to it"""
+            with BUS_LOCK:
+                select_mux_channel(bus, channel)
+                device.display(image)
+        
+        # One image, draw context and bounding box serve every step,
+        # instead of a fresh image per canvas() block
+        bbox = device.bounding_box
+        font = FONT
+        frame = Image.new(device.mode, device.size)
+        draw = ImageDraw.Draw(frame)
         
         # Clear display
-        with canvas(device) as draw:
-            draw.rectangle(device.bounding_box, outline="white", fill="black")
+        draw.rectangle(bbox, outline="white", fill="black")
+        show(frame)
         
         time.sleep(0.2)
         
         # Test 1: Display text
-        print(f"    Test 1: Displaying text...")
-        with canvas(device) as draw:
-            draw.rectangle(device.bounding_box, outline="white", fill="black")
-            draw.text((10, 10), f"{name}", fill="white")
-            draw.text((10, 30), f"Channel {channel}", fill="white")
-            draw.text((10, 50), f"Addr: 0x{addr:02X}", fill="white")
-            draw.text((10, 70), "Test OK!", fill="white")
+        _log(f"    [{name}] Test 1: Displaying text...")
+        draw.rectangle(bbox, outline="white", fill="black")
+        paste_text(frame, (10, 10), name, font)
+        paste_text(frame, (10, 30), f"Channel {channel}", font)
+        paste_text(frame, (10, 50), f"Addr: 0x{addr:02X}", font)
+        paste_text(frame, (10, 70), "Test OK!", font)
+        show(frame)
         
         time.sleep(2)
         
         # Test 2: Draw shapes
-        print(f"    Test 2: Drawing shapes...")
-        with canvas(device) as draw:
-            draw.rectangle(device.bounding_box, outline="white", fill="black")
-            draw.rectangle((10, 10, 118, 118), outline="white", fill="black")
-            draw.ellipse((30, 30, 98, 98), outline="white", fill="black")
-            draw.line((64, 30, 64, 98), fill="white")
-            draw.line((30, 64, 98, 64), fill="white")
+        _log(f"    [{name}] Test 2: Drawing shapes...")
+        draw.rectangle(bbox, outline="white", fill="black")
+        draw.rectangle((10, 10, 118, 118), outline="white", fill="black")
+        draw.ellipse((30, 30, 98, 98), outline="white", fill="black")
+        draw.line((64, 30, 64, 98), fill="white")
+        draw.line((30, 64, 98, 64), fill="white")
+        show(frame)
         
         time.sleep(2)
         
         # Test 3: Progress bar animation
-        print(f"    Test 3: Progress bar...")
+        _log(f"    [{name}] Test 3: Progress bar...")
+        # Render every frame up front so the loop only pushes framebuffers.
+        # The static parts are drawn once; each frame only adds the bar and
+        # percentage.
+        draw.rectangle(bbox, outline="white", fill="black")
+        paste_text(frame, (30, 40), "Loading...", font)
+        draw.rectangle((10, 60, 118, 75), outline="white", fill="black")
+        frames = []
         for progress in range(0, 101, 10):
-            with canvas(device) as draw:
-                draw.rectangle(device.bounding_box, outline="white", fill="black")
-                draw.text((30, 40), "Loading...", fill="white")
-                # Progress bar
-                bar_width = int((128 - 20) * progress / 100)
-                draw.rectangle((10, 60, 118, 75), outline="white", fill="black")
-                if bar_width > 0:
-                    draw.rectangle((10, 60, 10 + bar_width, 75), outline="white", fill="white")
-                draw.text((50, 85), f"{progress}%", fill="white")
+            progress_frame = frame.copy()
+            progress_draw = ImageDraw.Draw(progress_frame)
+            # Progress bar
+            bar_width = int((128 - 20) * progress / 100)
+            if bar_width > 0:
+                progress_draw.rectangle((10, 60, 10 + bar_width, 75), outline="white", fill="white")
+            paste_text(progress_frame, (50, 85), f"{progress}%", font)
+            frames.append(progress_frame)
+        
+        for progress_frame in frames:
+            show(progress_frame)
             time.sleep(0.1)
         
         time.sleep(1)
         
         # Test 4: Inverted display
-        print(f"    Test 4: Inverted display...")
-        with canvas(device) as draw:
-            draw.rectangle(device.bounding_box, outline="white", fill="white")
-            draw.text((20, 55), "INVERTED", fill="black")
+        _log(f"    [{name}] Test 4: Inverted display...")
+        draw.rectangle(bbox, outline="white", fill="white")
+        paste_text(frame, (20, 55), "INVERTED", font, fill="black")
+        show(frame)
         
         time.sleep(2)
         
         # Clear display
-        with canvas(device) as draw:
-            draw.rectangle(device.bounding_box, outline="white", fill="black")
-            draw.text((30, 55), "Test Done!", fill="white")
+        draw.rectangle(bbox, outline="white", fill="black")
+        paste_text(frame, (30, 55), "Test Done!", font)
+        show(frame)
         
         time.sleep(1)
         
         # Final clear
-        device.clear()
+        with BUS_LOCK:
+            select_mux_channel(bus, channel)
+            device.clear()
         
-        bus.close()
-        print(f"    ✓ All tests passed for {name}")
+        _log(f"    ✓ All tests passed for {name}")
         return True
         
     except Exception as e:
-        print(f"    ✗ Display test failed: {e}")
+        _log(f"    ✗ Display test failed for {name}: {e}")
         import traceback
         traceback.print_exc()
         return False
@@ -151,7 +228,7 @@ def main():
     print("="*60)
     
     try:
-        bus = smbus.SMBus(I2C_BUS)
+        bus = get_bus(I2C_BUS)
         
         # Test multiplexer
         print(f"\nTesting multiplexer at 0x{MUX_ADDR:02X}...")
@@ -174,7 +251,6 @@ def main():
         
         # Disable channels before display tests
         disable_mux_channels(bus)
-        bus.close()
         
         # Display functionality tests (if luma available)
         if LUMA_AVAILABLE:
@@ -183,10 +259,23 @@ def main():
             print("="*60)
             print("Running visual tests on each display...")
             
-            for config in OLED_CONFIGS:
-                if results[config['name']]:
-                    test_oled_display(config['channel'], config['address'], config['name'])
-                    time.sleep(0.5)
+            # One thread per display: rendering and the pauses between test
+            # steps overlap, only the bus writes are serialized (BUS_LOCK)
+            threads = [
+                threading.Thread(
+                    target=test_oled_display,
+                    args=(bus, config['channel'], config['address'], config['name'])
+                )
+                for config in OLED_CONFIGS
+                if results[config['name']]
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            
+            close_displays(bus)
+            disable_mux_channels(bus)
         
         # Summary
         print("\n" + "="*60)